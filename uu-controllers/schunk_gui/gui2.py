@@ -18,7 +18,7 @@ try:
     import math
     from math import pi
     from math import degrees
-    from threading import Thread
+    from threading import Thread, Timer
     import tf
 
 except:
@@ -77,8 +77,18 @@ class RosCommunication():
         # Setup all of the pubs and subs
         self.velocityPub = rospy.Publisher(VELOCITY_CMD_TOPIC, JointState)
         self.positionPub = rospy.Publisher(POSITION_CMD_TOPIC, JointState)
+        self.ackPub = rospy.Publisher("/ack", Int8, latch=True)
+        self.refPub = rospy.Publisher("/ref", Int8, latch=True)
+        self.ackAllPub = rospy.Publisher("/ackAll", Bool, latch=True)
+        self.refAllPub = rospy.Publisher("/refAll", Bool, latch=True)
+        self.currentsMaxAllPub = rospy.Publisher("/currentsMaxAll", Bool, latch=True)
+        self.emergencyPub = rospy.Publisher("/emergency", Bool, latch=True)
+        self.commandPubs = [self.velocityPub, self.positionPub, self.ackPub, self.refPub, self.ackAllPub,
+                            self.refAllPub, self.currentsMaxAllPub, self.emergencyPub]
         self.jointSub = rospy.Subscriber(JOINT_STATE_TOPIC, JointState, self.jointStateUpdate)
         self.statusSub = rospy.Subscriber(SCHUNK_STATUS_TOPIC, SchunkStatus, self.schunkStatusUpdate)
+        # subscribers need a moment to connect before they can be counted
+        Timer(1.0, self.reportCommandSubscribers).start()
         
         # Members that will be filled by the gui for commanding
         self.targetVelocity = JointState()
@@ -113,6 +123,15 @@ class RosCommunication():
         self.currentSchunkStatus = data
         pass
 
+    def reportCommandSubscribers(self):
+        """ Tell which command topics have nobody listening, called once shortly after startup. """
+        for pub in self.commandPubs:
+            connections = pub.get_num_connections()
+            if connections == 0:
+                rospy.logwarn("No subscriber on command topic %s, commands sent there will be lost", pub.name)
+            else:
+                rospy.loginfo("Command topic %s has %d subscriber(s)", pub.name, connections)
+
     # The actual communication loop
     def loop(self):
         hz = 10 # 10hz
@@ -131,27 +150,27 @@ class RosCommunication():
                 self.setVelocity = False
             if self.ackJoint:
                 print "/ack"
-                rospy.Publisher("/ack", Int8, latch=True).publish(self.ackNumber)
+                self.ackPub.publish(self.ackNumber)
                 self.ackJoint = False
             if self.refJoint:
                 self.refJoint = False
                 print "/ref"
-                rospy.Publisher("/ref", Int8, latch=True).publish(self.refNumber)
+                self.refPub.publish(self.refNumber)
             if self.ackAll:
                 print "/ackAll"
-                rospy.Publisher("/ackAll", Bool, latch=True).publish(True)
+                self.ackAllPub.publish(True)
                 self.ackAll = False
             if self.refAll:
                 print "/refAll"
-                rospy.Publisher("/refAll", Bool, latch=True).publish(True)
+                self.refAllPub.publish(True)
                 self.refAll = False
             if self.maxCurrents:
                 print "/currentsmaxall"
-                rospy.Publisher("/currentsMaxAll", Bool, latch=True).publish(True)
+                self.currentsMaxAllPub.publish(True)
                 self.maxCurrents = False
             if self.emergencyStop:
                 print "/emergency"
-                rospy.Publisher("/emergency", Bool, latch=True).publish(True)
+                self.emergencyPub.publish(True)
                 self.emergencyStop = False
             
             r.sleep()
@@ -2,7 +2,9 @@
 
 import os
 import sys
-from threading import Thread
+import time
+from collections import deque
+from threading import Thread, Timer, Lock, Condition
 
 import math
 from math import pi, radians, degrees
@@ -30,6 +32,14 @@ VELOCITY_CMD_TOPIC="/schunk/move_all_velocity"
 POSITION_CMD_TOPIC="/schunk/move_all_position"
 JOINT_STATE_TOPIC="/joint_states"
 SCHUNK_STATUS_TOPIC="/schunk/status"
+POSE_TRACKER_HZ = 20
+MOTION_COMMANDS = ("position", "velocity")    # dropped from the queue by an emergency stop
+FLAGS_REDRAW_MS = 50    # status messages within this time are drawn together
+# SchunkStatus flags shown as text: table column, message field, value that is drawn red
+STATUS_FLAGS = [("Referenced", "referenced", False), ("MoveEnd", "moveEnd", False), ("Brake", "brake", False),
+                ("Warning", "warning", True), ("Moving", "moving", True), ("PosReached", "posReached", False),
+                ("Error", "error", True)]
+POSE_LABELS = ["poseX", "poseY", "poseZ", "poseRoll", "posePitch", "poseYaw", "poseQx", "poseQy", "poseQz", "poseQw"]
 
 class RosCommunication():
     def __init__(self):
@@ -44,9 +54,15 @@ class RosCommunication():
         self.joint_names_list = []    # joint names in real order
         self.currentJointStates = JointState()
         self.currentJointStates_jointIndex_to_msgIndex_dict = {}
+        self.currentJointStates_layout = None    # message names the dict was built for
+        self.currentJointStates_indices = []    # (joint index, message index) pairs of the dict
+        self.currentJointStates_filled = False    # jointPositions hold values of the current layout
         self.currentSchunkStatus = SchunkStatus()
         self.currentSchunkStatus_jointIndex_to_msgIndex_dict = {}
+        self.currentSchunkStatus_layout = None
+        self.currentSchunkStatus_indices = []
         self.dependent_joints = rospy.get_param("dependent_joints", {})
+        self.onStateUpdate = None    # called from the subscriber threads after every joint state or status message
        
         if rospy.has_param("~tip_name"):
             print "YEEEE"
@@ -100,128 +116,260 @@ class RosCommunication():
                 
                 self.numModules += 1
 
+        # Latest state of every joint by real index, filled by the subscriber callbacks for the gui
+        self.jointPositions = [0.0] * self.numModules
+        self.jointPositionsValid = [False] * self.numModules    # joint is in the last JointState message
+        self.jointStatus = [None] * self.numModules    # SchunkStatus entry of the joint, None if missing
+
         # Setup all of the pubs and subs
         self.velocityPub = rospy.Publisher(VELOCITY_CMD_TOPIC, JointState)
         self.positionPub = rospy.Publisher(POSITION_CMD_TOPIC, JointState)
+        self.ackPub = rospy.Publisher("/schunk/ack", Int8)
+        self.refPub = rospy.Publisher("/schunk/ref", Int8)
+        self.ackAllPub = rospy.Publisher("/schunk/ack_all", Empty)
+        self.refAllPub = rospy.Publisher("/schunk/ref_all", Empty)
+        self.currentMaxAllPub = rospy.Publisher("/schunk/set_current_max_all", Empty)
+        self.emergencyStopPub = rospy.Publisher("/schunk/emergency_stop", Empty)
+        self.commandPubs = [self.velocityPub, self.positionPub, self.ackPub, self.refPub, self.ackAllPub,
+                            self.refAllPub, self.currentMaxAllPub, self.emergencyStopPub]
         self.jointSub = rospy.Subscriber(JOINT_STATE_TOPIC, JointState, self.jointStateUpdate)
         self.statusSub = rospy.Subscriber(SCHUNK_STATUS_TOPIC, SchunkStatus, self.schunkStatusUpdate)
+        # subscribers need a moment to connect before they can be counted
+        Timer(1.0, self.reportCommandSubscribers).start()
         
-        # Members that will be filled by the gui for commanding
-        self.targetVelocity = JointState()
-        self.targetPosition = JointState()
-        self.setVelocity = False
-        self.setPosition = False
-        
-        self.ackJoint = False
-        self.ackNumber =0
-        self.refJoint = False
-        self.refNumber =0
-        self.ackAll = False
-        self.refAll = False
-        self.maxCurrents = False
-        self.emergencyStop = False
+        # Commands queued by the gui, sent in order by loop() as soon as they come in
+        self.commands = deque()
+        self.commandsCondition = Condition()
+        rospy.on_shutdown(self.wakeLoop)
+        self.lastCommandLatency = None    # seconds from queueing to publishing of the last command
 
 #        self.targetCurrent = JointState() # TODO: Set the current controls with the effort field (in SchunkRos also) 
 
         # A tf listener so that we can find the position of the end effector without service calls to
         # kinematics node
         self.tfListener = tf.TransformListener()
+        
+        # Latest end effector pose, kept up to date by trackEndPosition so the gui never waits for tf
+        self.poseMaxAge = rospy.get_param("~pose_max_age", 0.5)   # seconds, older poses are shown as stale
+        self.poseLock = Lock()
+        self.endPose = None
+        self.endPoseStamp = None
 
         
         
     def jointStateUpdate(self, data):
-        """ Store new joint states data and calculate the index lookup dict as the message might not be sorted.
+        """ Store new joint states data into jointPositions, using an index lookup dict as the message might not be sorted.
         
         In other words: When the joint has real index x, which index does it have in this message?
-        So no states consuming method should sort or search in the msg name array anymore!
+        The dict only changes with the name list of the message, so it is rebuilt only then.
         """
         self.currentJointStates = data
         
-        # get name_to_index dict for message
-        self.currentJointStates_jointIndex_to_msgIndex_dict = {}
-        for msg_i in range(len(self.currentJointStates.name)):
-            msg_name = self.currentJointStates.name[msg_i]
-            try:
-                name_i = self.joint_name_to_index_dict[msg_name]
-                self.currentJointStates_jointIndex_to_msgIndex_dict[name_i] = msg_i
-            except KeyError:
-                # message removed because this case is happening with mimicking joints
-                # rospy.logwarn("JointStatus message contains a joint I don't know from the robot_description: %s.", msg_name)
-                pass
+        layout = tuple(data.name)
+        if layout != self.currentJointStates_layout:
+            # get name_to_index dict for message
+            lookup = {}
+            for msg_i in range(len(layout)):
+                msg_name = layout[msg_i]
+                try:
+                    name_i = self.joint_name_to_index_dict[msg_name]
+                    lookup[name_i] = msg_i
+                except KeyError:
+                    # message removed because this case is happening with mimicking joints
+                    # rospy.logwarn("JointStatus message contains a joint I don't know from the robot_description: %s.", msg_name)
+                    pass
+            self.currentJointStates_jointIndex_to_msgIndex_dict = lookup
+            self.currentJointStates_layout = layout
+            self.currentJointStates_indices = lookup.items()
+            self.currentJointStates_filled = False
+            for name_i in range(self.numModules):
+                self.jointPositionsValid[name_i] = False    # until positions of this layout came in
+        
+        position = data.position
+        if len(position) < len(layout):
+            return    # message without positions
+        for name_i, msg_i in self.currentJointStates_indices:
+            self.jointPositions[name_i] = position[msg_i]
+        if not self.currentJointStates_filled:
+            for name_i, msg_i in self.currentJointStates_indices:
+                self.jointPositionsValid[name_i] = True
+            self.currentJointStates_filled = True
+        if self.onStateUpdate is not None:
+            self.onStateUpdate()
     
     def schunkStatusUpdate(self, data):
-        """ Store new schunk status data and calculate the index lookup dict as the message might not be sorted.
+        """ Store new schunk status data into jointStatus, using an index lookup dict as the message might not be sorted.
         
         In other words: When the joint has real index x, which index does it have in this message?
-        So no status consuming method should sort or search in the msg name array anymore!
+        The dict only changes with the joint names of the message, so it is rebuilt only then.
         """  
         self.currentSchunkStatus = data
         
-        # get name_to_index dict for message
-        self.currentSchunkStatus_jointIndex_to_msgIndex_dict = {}
-        for msg_i in range(len(self.currentSchunkStatus.joints)):
-            msg_name = self.currentSchunkStatus.joints[msg_i].jointName
-            try:
-                name_i = self.joint_name_to_index_dict[msg_name]
-                self.currentSchunkStatus_jointIndex_to_msgIndex_dict[name_i] = msg_i
-            except KeyError:
-                rospy.logwarn("SchunkStatus message contains a joint I don't know from the robot_description: %s.", msg_name)
-
+        layout = tuple([joint.jointName for joint in data.joints])
+        if layout != self.currentSchunkStatus_layout:
+            # get name_to_index dict for message
+            lookup = {}
+            for msg_i in range(len(layout)):
+                msg_name = layout[msg_i]
+                try:
+                    name_i = self.joint_name_to_index_dict[msg_name]
+                    lookup[name_i] = msg_i
+                except KeyError:
+                    rospy.logwarn("SchunkStatus message contains a joint I don't know from the robot_description: %s.", msg_name)
+            self.currentSchunkStatus_jointIndex_to_msgIndex_dict = lookup
+            self.currentSchunkStatus_layout = layout
+            self.currentSchunkStatus_indices = lookup.items()
+            for name_i in range(self.numModules):
+                self.jointStatus[name_i] = None
+        
+        joints = data.joints
+        for name_i, msg_i in self.currentSchunkStatus_indices:
+            self.jointStatus[name_i] = joints[msg_i]
+        if self.onStateUpdate is not None:
+            self.onStateUpdate()
+
+    def reportCommandSubscribers(self):
+        """ Tell which command topics have nobody listening, called once shortly after startup. """
+        for pub in self.commandPubs:
+            connections = pub.get_num_connections()
+            if connections == 0:
+                rospy.logwarn("No subscriber on command topic %s, commands sent there will be lost", pub.name)
+            else:
+                rospy.loginfo("Command topic %s has %d subscriber(s)", pub.name, connections)
 
-    # The actual communication loop
-    def loop(self):
-        hz = 10 # 10hz
-        r = rospy.Rate(hz) 
+    def queueCommand(self, kind, argument=None, urgent=False):
+        """ Queue a command for loop() to send, urgent ones (emergency stop) go before all others.
         
+        Motion commands still waiting are dropped by an urgent one, they must not follow the stop.
+        """
+        self.commandsCondition.acquire()
+        if urgent:
+            pending = [command for command in self.commands if command[0] not in MOTION_COMMANDS]
+            dropped = len(self.commands) - len(pending)
+            if dropped:
+                rospy.logwarn("Dropped %d queued motion command(s) for %s", dropped, kind)
+            self.commands = deque(pending)
+            self.commands.appendleft((kind, argument, time.time()))
+        else:
+            self.commands.append((kind, argument, time.time()))
+        self.commandsCondition.notify()
+        self.commandsCondition.release()
+
+    def sendPosition(self, names, positions):
+        target = JointState()
+        target.name = list(names)
+        target.position = list(positions)
+        self.queueCommand("position", target)
+
+    def sendVelocity(self, names, velocities):
+        target = JointState()
+        target.name = list(names)
+        target.velocity = list(velocities)
+        self.queueCommand("velocity", target)
+
+    def sendAck(self, module):
+        self.queueCommand("ack", module)
+
+    def sendRef(self, module):
+        self.queueCommand("ref", module)
+
+    def sendAckAll(self):
+        self.queueCommand("ackAll")
+
+    def sendRefAll(self):
+        self.queueCommand("refAll")
+
+    def sendMaxCurrents(self):
+        self.queueCommand("maxCurrents")
+
+    def sendEmergencyStop(self):
+        self.queueCommand("emergencyStop", urgent=True)
+
+    def publishCommand(self, kind, argument):
+        if kind == "position":
+            argument.header.stamp = rospy.Time.now()
+            self.positionPub.publish(argument)
+        elif kind == "velocity":
+            argument.header.stamp = rospy.Time.now()
+            self.velocityPub.publish(argument)
+        elif kind == "ack":
+            self.ackPub.publish(argument)
+        elif kind == "ref":
+            self.refPub.publish(argument)
+        elif kind == "ackAll":
+            self.ackAllPub.publish()
+        elif kind == "refAll":
+            self.refAllPub.publish()
+        elif kind == "maxCurrents":
+            self.currentMaxAllPub.publish()
+        elif kind == "emergencyStop":
+            self.emergencyStopPub.publish()
+
+    def wakeLoop(self):
+        """ Let loop() notice the shutdown. """
+        self.commandsCondition.acquire()
+        self.commandsCondition.notify()
+        self.commandsCondition.release()
+
+    # The actual communication loop, sends the queued commands
+    def loop(self):
         while not rospy.is_shutdown():
-            self.targetPosition.header.stamp = rospy.Time.now()
-
-            # Publish commands if wanted
-            if self.setPosition:
-                self.positionPub.publish(self.targetPosition)
-                self.setPosition = False
-            if self.setVelocity:
-                self.velocityPub.publish(self.targetVelocity)
-                self.setVelocity = False
-            if self.ackJoint:
-                print "/ack"
-                rospy.Publisher("/schunk/ack", Int8).publish(self.ackNumber)
-                self.ackJoint = False
-            if self.refJoint:
-                self.refJoint = False
-                print "/ref"
-                rospy.Publisher("/schunk/ref", Int8).publish(self.refNumber)
-            if self.ackAll:
-                print "/ackAll"
-                rospy.Publisher("/schunk/ack_all", Empty).publish()
-                self.ackAll = False
-            if self.refAll:
-                print "/refAll"
-                rospy.Publisher("/schunk/ref_all", Empty).publish()
-                self.refAll = False
-            if self.maxCurrents:
-                print "/currentsmaxall"
-                rospy.Publisher("/schunk/set_current_max_all", Empty).publish()
-                self.maxCurrents = False
-            if self.emergencyStop:
-                print "/emergency"
-                rospy.Publisher("/schunk/emergency_stop", Empty).publish()
-                self.emergencyStop = False
-            
-            r.sleep()
+            self.commandsCondition.acquire()
+            while not self.commands and not rospy.is_shutdown():
+                self.commandsCondition.wait()    # a timed wait would poll, woken by queueCommand and wakeLoop
+            if not self.commands:
+                self.commandsCondition.release()
+                break
+            kind, argument, queued = self.commands.popleft()
+            self.commandsCondition.release()
+
+            self.publishCommand(kind, argument)
+            self.lastCommandLatency = time.time() - queued
+            print "/%s sent after %.1f ms" % (kind, self.lastCommandLatency * 1000)
             
-    def getEndPosition(self):
+    # Keeps the latest root -> tip transform, run in its own thread
+    def trackEndPosition(self):
         frame_from = self.__root
         frame_to = self.__tip
-
+        if frame_from == "none" or frame_to == "none":
+            return
+        
+        r = rospy.Rate(POSE_TRACKER_HZ)
+        failed = False
         try:
-            now = rospy.Time(0) # just get the latest rospy.Time.now()
-            self.tfListener.waitForTransform(frame_from, frame_to, now, rospy.Duration(3.0))
-            (trans,rot) = self.tfListener.lookupTransform(frame_from, frame_to, now)
-        except (tf.LookupException, tf.ConnectivityException):
-            rospy.logerr("Can't get end effector transform!")
-            return 0, 0, 0, 0, 0, 0, 0
-        return trans[0], trans[1], trans[2], rot[0], rot[1], rot[2], rot[3]
+            while not rospy.is_shutdown():
+                try:
+                    stamp = self.tfListener.getLatestCommonTime(frame_from, frame_to)
+                    (trans,rot) = self.tfListener.lookupTransform(frame_from, frame_to, stamp)
+                    pose = (trans[0], trans[1], trans[2], rot[0], rot[1], rot[2], rot[3])
+                    self.poseLock.acquire()
+                    self.endPose = pose
+                    self.endPoseStamp = stamp
+                    self.poseLock.release()
+                    failed = False
+                except tf.Exception, e:
+                    if not failed:
+                        rospy.logwarn("Can't get end effector transform: %s", e)
+                    failed = True
+                r.sleep()
+        except rospy.ROSInterruptException:
+            pass    # shut down while sleeping
+            
+    def getEndPosition(self):
+        """ Latest end effector pose and its age in seconds, never blocks.
+        
+        The pose is (x, y, z, qx, qy, qz, qw), all zeros with age None while no transform has been seen.
+        """
+        self.poseLock.acquire()
+        pose = self.endPose
+        stamp = self.endPoseStamp
+        self.poseLock.release()
+        if pose is None:
+            return (0, 0, 0, 0, 0, 0, 0), None
+        age = (rospy.Time.now() - stamp).to_sec()
+        if stamp.is_zero():
+            age = 0.0    # static transform, always valid
+        return pose, age
 
 
 
@@ -236,6 +384,11 @@ class SchunkTextControl:
         # run roscomms in a seperate thread
         self.roscommsThread = Thread(target=self.roscomms.loop)
         self.roscommsThread.start()
+        # track the end effector pose in another one
+        self.poseThread = Thread(target=self.roscomms.trackEndPosition)
+        self.poseThread.daemon = True    # only reads tf, nothing to finish
+        self.poseThread.start()
+        self.poseStale = None
         
         # get number of modules
         self.numModules = self.roscomms.numModules
@@ -416,6 +569,12 @@ class SchunkTextControl:
                 flagsRow.append(label)
             self.flags.append(flagsRow)
         self.wTree.get_object("flagsFrame").show_all()
+        # last text and colour drawn in each flags cell, only changes are drawn
+        self.flagsCache = [[(None, None)] * len(flagsTitles) for i in range(self.numModules)]
+        self.flagsColors = {False:gtk.gdk.color_parse('#000000'), True:gtk.gdk.color_parse('#FF0000')}
+        # the table is redrawn when new states come in, not on a timer
+        self.flagsRedrawPending = False
+        self.roscomms.onStateUpdate = self.schedule_update_flags
                         
         # no argument full interface, also medium and mini modes
         if argc > 1:
@@ -449,8 +608,9 @@ class SchunkTextControl:
         # kill ros thread
         rospy.signal_shutdown("Because I said so!")
         
-        # Wait for roscomm thread to stop
+        # Wait for roscomm threads to stop
         self.roscommsThread.join()
+        self.poseThread.join()
 
 
     def set_status_text_info(self, status_string):
@@ -511,7 +671,7 @@ class SchunkTextControl:
     def emergency_stop(self, widget):
         if widget.get_active():
             # STOP
-            self.roscomms.emergencyStop = True
+            self.roscomms.sendEmergencyStop()
             self.wTree.get_object("aPoseFrame").set_sensitive(False)
             self.wTree.get_object("aVelFrame").set_sensitive(False)
             self.wTree.get_object("aFlagsFrame").set_sensitive(False)
@@ -520,13 +680,11 @@ class SchunkTextControl:
             self.set_status_text("Astalavista baby. No way Master Yianni's fault", '#FF0000')
         else:
             # GO
-            #self.roscomms.emergencyStop = False
             #self.ack("ack all".split())
+            # the acks are sent one after the other in this order
             for i in range(0,self.numModules):
                 command = "ack " + str(i) 
                 self.ack(command.split())
-                while self.roscomms.ackJoint == True:
-                    pass
             self.wTree.get_object("aPoseFrame").set_sensitive(True)
             self.wTree.get_object("aVelFrame").set_sensitive(True)
             self.wTree.get_object("aFlagsFrame").set_sensitive(True)
@@ -896,19 +1054,18 @@ class SchunkTextControl:
         try:
             module = tokens[1]
             if module == "all":
-                self.roscomms.ackAll = True
+                self.roscomms.sendAckAll()
                 return
             try:
                 module = int(module)
                 if module >= 0 and module < self.numModules:
-                    self.roscomms.ackNumber = module
-                    self.roscomms.ackJoint = True
+                    self.roscomms.sendAck(module)
                 else:
                     self.set_status_text_error("ack failed. Module does not exist")
             except:
                 self.set_status_text_error("move velocity failed. Module does not exist")
         except:
-            self.roscomms.ackAll = True
+            self.roscomms.sendAckAll()
 
 
     def cb_ref_all(self, widget):
@@ -923,13 +1080,12 @@ class SchunkTextControl:
         try:
             module = tokens[1]
             if module == "all":
-                self.roscomms.refAll = True
+                self.roscomms.sendRefAll()
                 return
             try:
                 module = int(module)
                 if module >= 0 and module < self.numModules:
-                    self.roscomms.refNumber = module
-                    self.roscomms.refJoint = True
+                    self.roscomms.sendRef(module)
                 else:
                     self.set_status_text_error("ref failed. Module does not exist")
             except:
@@ -974,21 +1130,13 @@ class SchunkTextControl:
                             value = float(value)
                             if self.inDegrees:
                                 value = radians(value)
-                            self.roscomms.targetPosition.name=[]
-                            self.roscomms.targetPosition.name.append(self.roscomms.joint_names_list[module])
-                            self.roscomms.targetPosition.position = [value]
-                            #print self.roscomms.targetPosition
-                            self.roscomms.setPosition = True
+                            self.roscomms.sendPosition([self.roscomms.joint_names_list[module]], [value])
                         except:
                             print "move failed: not valid value"
                     except:
                         # move from spinbutton if tokens[2] not given
                         value = radians(float(self.posesframe_spinButtons[module].get_value()))
-                        self.roscomms.targetPosition.name=[]
-                        self.roscomms.targetPosition.name.append(self.roscomms.joint_names_list[module])
-                        self.roscomms.targetPosition.position = [value]
-                        #print self.roscomms.targetPosition
-                        self.roscomms.setPosition = True 
+                        self.roscomms.sendPosition([self.roscomms.joint_names_list[module]], [value])
                 else:
                     self.set_status_text_error("move failed. Module does not exist")
             except:
@@ -998,17 +1146,16 @@ class SchunkTextControl:
 
 
     def move_all(self):
-        self.roscomms.targetPosition.name=[]
-        self.roscomms.targetPosition.position=[]
+        names = []
+        positions = []
         for module in range(0,self.numModules):
             name = self.roscomms.joint_names_list[module]
-            self.roscomms.targetPosition.name.append(name)
+            names.append(name)
             value = float(self.posesframe_spinButtons[module].get_value())
             if self.inDegrees: # convert to radians, else it is already in radians
                 value = radians(value)
-            self.roscomms.targetPosition.position.append(value)
-            #print roscomms.targetPosition
-            self.roscomms.setPosition = True
+            positions.append(value)
+        self.roscomms.sendPosition(names, positions)
 
 
     def cb_currents_max(self, widget):
@@ -1021,7 +1168,7 @@ class SchunkTextControl:
         try:
             module = tokens[1]
             if module == "all":
-                self.roscomms.maxCurrents = True
+                self.roscomms.sendMaxCurrents()
                 return
             try:
                 module = int(module)
@@ -1032,7 +1179,7 @@ class SchunkTextControl:
             except:
                 self.set_status_text_error("currents max failed. Module does not exist")
         except:
-            self.roscomms.maxCurrents = True
+            self.roscomms.sendMaxCurrents()
     
 
     def cb_move_vel_all(self, widget):
@@ -1040,14 +1187,14 @@ class SchunkTextControl:
 
         
     def cb_stop_vel_all(self, widget):
-        self.roscomms.targetVelocity.name=[]
-        self.roscomms.targetVelocity.velocity=[]
+        names = []
+        velocities = []
         for module in range(0,self.numModules):
             name = self.roscomms.joint_names_list[module]
-            self.roscomms.targetVelocity.name.append(name)
+            names.append(name)
             value = 0.0
-            self.roscomms.targetVelocity.velocity.append(value)
-            self.roscomms.setVelocity = True
+            velocities.append(value)
+        self.roscomms.sendVelocity(names, velocities)
 #        for i in range(0,self.numModules):
 #            command = "vel " + str(i) + " 0"
 #            tokens = command.split()
@@ -1070,19 +1217,13 @@ class SchunkTextControl:
                             return
                         try:
                             value = radians(float(value))
-                            self.roscomms.targetVelocity.name=[]
-                            self.roscomms.targetPosition.name.append(self.roscomms.joint_names_list[module])
-                            self.roscomms.targetVelocity.velocity = [value]
-                            self.roscomms.setVelocity = True
+                            self.roscomms.sendVelocity([self.roscomms.joint_names_list[module]], [value])
                         except:
                             print "move_vel failed: not valid value"
                     except:
                         # move from spinbutton if tokens[2] not given
                         value = radians(float(self.velframe_spinButtons[module].get_value()))
-                        self.roscomms.targetVelocity.name=[]
-                        self.roscomms.targetPosition.name.append(self.roscomms.joint_names_list[module])
-                        self.roscomms.targetVelocity.velocity = [value]
-                        self.roscomms.setVelocity = True 
+                        self.roscomms.sendVelocity([self.roscomms.joint_names_list[module]], [value])
                 else:
                     self.set_status_text_error("move velocity failed. Module does not exist")
             except:
@@ -1092,14 +1233,14 @@ class SchunkTextControl:
       
 
     def move_vel_all(self):
-        self.roscomms.targetVelocity.name=[]
-        self.roscomms.targetVelocity.velocity=[]
+        names = []
+        velocities = []
         for i in range(0,self.numModules):
             name = self.roscomms.joint_names_list[i]
-            self.roscomms.targetVelocity.name.append(name)
+            names.append(name)
             value = radians(float(self.velframe_spinButtons[i].get_value()))
-            self.roscomms.targetVelocity.velocity.append(value)
-            self.roscomms.setVelocity = True
+            velocities.append(value)
+        self.roscomms.sendVelocity(names, velocities)
 
 
     def vel_spinButton_enter_pressed(self, widget):
@@ -1133,114 +1274,62 @@ class SchunkTextControl:
                 self.posesframe_spinButtons[i].update()
    
 
+    def schedule_update_flags(self):
+        """ Called from the ros threads: redraw the flags once for all messages arriving within FLAGS_REDRAW_MS. """
+        if not self.flagsRedrawPending:
+            self.flagsRedrawPending = True
+            gobject.timeout_add(FLAGS_REDRAW_MS, self.update_flags)
+
+
+    def set_flag(self, module_i, column, text, red=None):
+        """ Draw a flags cell if its text or colour changed, red=None leaves the colour alone. """
+        cachedText, cachedRed = self.flagsCache[module_i][column]
+        if red is None:
+            red = cachedRed
+        if text == cachedText and red == cachedRed:
+            return
+        label = self.flags[module_i][column]
+        if text != cachedText:
+            label.set_text(text)
+        if red != cachedRed:
+            label.modify_fg(gtk.STATE_NORMAL, self.flagsColors[red])
+        self.flagsCache[module_i][column] = (text, red)
+
+
     def update_flags(self, *args):
+        self.flagsRedrawPending = False
         for module_i in range(self.numModules):
             ## joint state
-            try:
-                # lookup index in message for current module
-                msg_i = self.roscomms.currentJointStates_jointIndex_to_msgIndex_dict[module_i]
-                
-                label = self.flags[module_i][self.flagsDict["Position"]]
-                flagRadians = self.roscomms.currentJointStates.position[msg_i]            
+            if self.roscomms.jointPositionsValid[module_i]:
+                flagRadians = self.roscomms.jointPositions[module_i]
                 flag = degrees(flagRadians)
                 if (flag < 0.05) and (flag > -0.05):
                     flag = 0.0            
                 string = "%.2f / %.3f" % (flag, flagRadians)
-                label.set_text(string)
-                #flag = round(flag, 2)
-                #label.set_text(str(flag))
-            except KeyError:
+                self.set_flag(module_i, self.flagsDict["Position"], string)
+            else:
                 self.set_status_text_error("Joint '"+self.roscomms.joint_names_list[module_i]+"' not found in JointState message!")
             
             ## schunk status
-            try:
-                # lookup index in message for current module
-                msg_i = self.roscomms.currentSchunkStatus_jointIndex_to_msgIndex_dict[module_i]
-
-                label = self.flags[module_i][self.flagsDict["Referenced"]]
-                flag = self.roscomms.currentSchunkStatus.joints[msg_i].referenced
-                label.set_text(str(flag))
-                if not flag:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#FF0000'))
-                else:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#000000'))
-                    
-                label = self.flags[module_i][self.flagsDict["MoveEnd"]]
-                flag = self.roscomms.currentSchunkStatus.joints[msg_i].moveEnd
-                label.set_text(str(flag))
-                if not flag:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#FF0000'))
-                else:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#000000'))
-
-                label = self.flags[module_i][self.flagsDict["Brake"]]
-                flag = self.roscomms.currentSchunkStatus.joints[msg_i].brake
-                label.set_text(str(flag))
-                if not flag:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#FF0000'))
-                else:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#000000'))
-
-
-                label = self.flags[module_i][self.flagsDict["Warning"]]
-                flag = self.roscomms.currentSchunkStatus.joints[msg_i].warning
-                label.set_text(str(flag))
-                if flag:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#FF0000'))
-                else:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#000000'))
-
-                label = self.flags[module_i][self.flagsDict["Current"]]
-                flag = self.roscomms.currentSchunkStatus.joints[msg_i].current
-                string = "%.2f" % flag
-                label.set_text(string)
-                #flag = round(flag,2)
-                #label.set_text(str(flag))
-
-                label = self.flags[module_i][self.flagsDict["Moving"]]
-                flag = self.roscomms.currentSchunkStatus.joints[msg_i].moving
-                label.set_text(str(flag))
-                if flag:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#FF0000'))
-                else:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#000000'))
-
-                label = self.flags[module_i][self.flagsDict["PosReached"]]
-                flag = self.roscomms.currentSchunkStatus.joints[msg_i].posReached
-                label.set_text(str(flag))
-                if not flag:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#FF0000'))
-                else:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#000000'))
-     
-                label = self.flags[module_i][self.flagsDict["Error"]]
-                flag = self.roscomms.currentSchunkStatus.joints[msg_i].error
-                label.set_text(str(flag))
-                if flag:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#FF0000'))
-                else:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#000000'))
-                    
-                label = self.flags[module_i][self.flagsDict["ErrorCode"]]
-                flag = self.roscomms.currentSchunkStatus.joints[msg_i].errorCode
-                label.set_text(str(flag))
-                if flag != 0:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#FF0000'))
-                else:
-                    label.modify_fg(gtk.STATE_NORMAL, gtk.gdk.color_parse('#000000'))
-            except:
+            status = self.roscomms.jointStatus[module_i]
+            if status is not None:
+                for column, field, redValue in STATUS_FLAGS:
+                    flag = getattr(status, field)
+                    self.set_flag(module_i, self.flagsDict[column], str(flag), bool(flag) == redValue)
+
+                self.set_flag(module_i, self.flagsDict["Current"], "%.2f" % status.current)
+                self.set_flag(module_i, self.flagsDict["ErrorCode"], str(status.errorCode), status.errorCode != 0)
+            else:
                 self.set_status_text_error("Joint '"+self.roscomms.joint_names_list[module_i]+"' not found in SchunkStatus message!")
             
-        return True
+        # run once per schedule_update_flags
+        return False
 
 
     def on_buttonCopyCurrent_clicked(self, widget):
         for module_i in range(self.numModules):
-            try:
-                # lookup index in message for current module
-                msg_i = self.roscomms.currentJointStates_jointIndex_to_msgIndex_dict[module_i]
-                
-                posRadians = float(self.roscomms.currentJointStates.position[msg_i])
+            if self.roscomms.jointPositionsValid[module_i]:
+                posRadians = float(self.roscomms.jointPositions[module_i])
                 if self.inDegrees:
                     posDegrees = degrees(posRadians)
                     if (posDegrees < 0.05) and (posDegrees > -0.05):
@@ -1254,12 +1343,12 @@ class SchunkTextControl:
                 else:
 #                    posRadians = round(posRadians, 4)
                     self.posesframe_spinButtons[module_i].set_value(posRadians)
-            except KeyError:
+            else:
                 self.set_status_text_error("Joint '"+self.roscomms.joint_names_list[module_i]+"' not found in joint state message!")
 
 
     def update_pose(self, *args):
-        value = self.roscomms.getEndPosition()
+        value, age = self.roscomms.getEndPosition()
         pose = []
         for v in value:
             pose.append(v)
@@ -1296,6 +1385,23 @@ class SchunkTextControl:
         msg = "%.2f" % pose[6]
         self.wTree.get_object("poseQw").set_text(msg)
 
+        # grey out the pose when the transform is missing or old
+        stale = (age is None) or (age > self.roscomms.poseMaxAge)
+        if stale != self.poseStale:
+            self.poseStale = stale
+            if stale:
+                color = gtk.gdk.color_parse('#A0A0A0')
+            else:
+                color = gtk.gdk.color_parse('#000000')
+                self.wTree.get_object("aPoseFrame").set_tooltip_text(None)
+            for name in POSE_LABELS:
+                self.wTree.get_object(name).modify_fg(gtk.STATE_NORMAL, color)
+        if stale:
+            if age is None:
+                self.wTree.get_object("aPoseFrame").set_tooltip_text("No end effector transform")
+            else:
+                self.wTree.get_object("aPoseFrame").set_tooltip_text("End effector pose is %.1f s old" % age)
+
         return True
 
 
@@ -1340,7 +1446,6 @@ if __name__ == "__main__":
     rospy.init_node('schunk_gui')
     gui = SchunkTextControl()
     #Thread(target=gui.roscomms.loop).start() # statement is in the constructor of SchunkTextControl, either there or here
-    gobject.timeout_add(100, gui.update_flags)
     gobject.timeout_add(100, gui.update_pose)
     gtk.main()
     rospy.spin()
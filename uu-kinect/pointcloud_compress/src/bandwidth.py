@@ -0,0 +1,89 @@
+"""
+Closed loop bandwidth control for the compressor.
+
+The settings the compressor may trade for bandwidth form a ladder, from the
+configured ones down to the cheapest: highest compression level, coarser
+quantization (quantized and depth modes), growing voxel size, and finally
+lower frame rate.  Every period the compressed bandwidth and the time spent
+publishing since the last check are measured.  Over budget, or when
+publishing took more than max_busy of the period, the compressor moves one
+step down.  It moves back up only when the
+bandwidth is below low times the budget, hold periods have passed since the
+last change, and the step above was not itself seen over budget within
+the last memory periods.  Together these keep the settings from oscillating.
+"""
+import time
+import collections
+import rospy
+
+Setting = collections.namedtuple('Setting', 'level hz voxel_size resolution')
+
+def ladder(start, quantized, min_hz=0.5, max_voxel=0.16, max_resolution=0.016):
+	steps = [start]
+	def add(**change):
+		steps.append(steps[-1]._replace(**change))
+	if start.level < 9:
+		add(level=9)
+	if quantized:
+		while steps[-1].resolution * 2 <= max_resolution:
+			add(resolution=steps[-1].resolution * 2)
+	voxel = steps[-1].voxel_size * 2 or 0.01
+	while voxel <= max_voxel:
+		add(voxel_size=voxel)
+		voxel *= 2
+	while steps[-1].hz / 2.0 >= min_hz:
+		add(hz=steps[-1].hz / 2.0)
+	return steps
+
+class BandwidthController(object):
+	def __init__(self, compressor, max_kbps, start, quantized, period=1.0, low=0.7, hold=3, memory=30,
+			max_busy=0.5):
+		self.compressor = compressor
+		self.max_kbps = max_kbps
+		self.max_busy = max_busy
+		self.period = period
+		self.low = low
+		self.hold = hold
+		self.memory = memory
+		self.steps = ladder(start, quantized)
+		self.step = 0
+		self.since_change = 0
+		self.over = {}	# step -> periods since it was last seen over budget
+		self.last_bytes, self.last_publish = compressor.telemetry.totals()
+		self.last_time = time.time()
+		rospy.Timer(rospy.Duration(period), self.update)
+
+	# Bandwidth and the share of the time spent publishing since the last check
+	def measure(self):
+		now = time.time()
+		total, publish = self.compressor.telemetry.totals()
+		elapsed = max(now - self.last_time, 1e-3)
+		kbps = (total - self.last_bytes) * 8 / 1000.0 / elapsed
+		busy = (publish - self.last_publish) / elapsed
+		self.last_bytes, self.last_publish, self.last_time = total, publish, now
+		return kbps, busy
+
+	def update(self, event=None):
+		kbps, busy = self.measure()
+		congested = kbps > self.max_kbps or busy > self.max_busy
+		self.since_change += 1
+		for step in self.over.keys():
+			self.over[step] += 1
+			if self.over[step] > self.memory:
+				del self.over[step]
+
+		if congested:
+			self.over[self.step] = 0
+			if self.step + 1 < len(self.steps):
+				self.change(self.step + 1, kbps)
+		elif kbps < self.low * self.max_kbps and self.since_change >= self.hold \
+				and self.step > 0 and self.step - 1 not in self.over:
+			self.change(self.step - 1, kbps)
+
+	def change(self, step, kbps):
+		self.step = step
+		self.since_change = 0
+		setting = self.steps[step]
+		rospy.loginfo("Point Cloud Compressor at %.0f of %.0f kbps, step %d: level %d, %g Hz, voxel %g, resolution %g.",
+				kbps, self.max_kbps, step, setting.level, setting.hz, setting.voxel_size, setting.resolution)
+		self.compressor.apply(setting)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Offline benchmark of the point cloud modes and codecs, no ROS master needed.
+#
+# Every mode/codec pair is run over synthetic Kinect-like frames of several
+# sizes (or over the frames of a log written by record.py) in a child
+# process of its own, so that peak memory can be attributed to it.  One JSON
+# object per case is printed: throughput, ratio, compress and decompress
+# latency percentiles and peak memory growth.
+#
+#   benchmark.py --sizes 320x240,640x480 --modes raw,depth --codecs zlib,bz2
+#   benchmark.py --log clouds.pclog --frames 50 --output results.jsonl
+import roslib; roslib.load_manifest('pointcloud_compress')
+import sys
+import json
+import time
+import resource
+import argparse
+import multiprocessing
+import numpy as np
+import codec
+import buffers
+import cloud_log
+import fragment
+import synthetic
+
+# Clouds of a recorded log, decoded back to PointCloud2.  Fragmented frames
+# are reassembled, and the layers of a progressive frame (which share its
+# stamp) give one cloud, at the deepest level recorded.
+def log_frames(path, count):
+	log = cloud_log.LogReader(path)
+	modes = {}
+	reassembler = fragment.Reassembler()
+	clouds = []
+	last = None	# stamp of the last progressive frame
+	for i in range(len(log)):
+		data = log.frame(i)[1]
+		if fragment.is_fragment(data):
+			frame = reassembler.add(data)
+			if frame is None:
+				continue
+			header, payload = frame[0], str(frame[1])
+		else:
+			header, payload = codec.unpack(data)
+		if header.mode not in modes:
+			modes[header.mode] = codec.make_mode(header.mode)
+		cloud = modes[header.mode].decode(payload)
+		if cloud is None:
+			continue
+		stamp = (header.secs, header.nsecs)
+		if hasattr(modes[header.mode], 'encode_layers') and stamp == last:
+			clouds[-1] = cloud	# refined by the next layer
+			continue
+		if len(clouds) == count:
+			break
+		clouds.append(cloud)
+		last = hasattr(modes[header.mode], 'encode_layers') and stamp or None
+	return clouds
+
+def percentile_ms(values, q):
+	return float(np.percentile(values, q) * 1000.0)
+
+def run_case(clouds, mode, codec_name, level, params):
+	base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	encoder = codec.make_mode(mode, params)
+	decoder = codec.make_mode(mode, params)
+	packed, unpacked = buffers.Buffer(), buffers.Buffer()
+	compress, decompress = [], []
+	raw_bytes = compressed_bytes = 0
+	for cloud in clouds:
+		start = time.time()
+		data = str(codec.pack_into(packed, mode, codec_name, level, cloud.header.stamp, encoder.encode(cloud)))
+		compress.append(time.time() - start)
+		start = time.time()
+		header, payload = codec.unpack_into(unpacked, data)
+		decoder.decode(payload)
+		decompress.append(time.time() - start)
+		raw_bytes += len(cloud.data)
+		compressed_bytes += len(data)
+	return {
+		'mode': mode, 'codec': codec_name, 'level': level, 'frames': len(clouds),
+		'raw_bytes': raw_bytes, 'compressed_bytes': compressed_bytes,
+		'ratio': float(raw_bytes) / max(compressed_bytes, 1),
+		'compress_mb_s': raw_bytes / 1e6 / max(sum(compress), 1e-9),
+		'decompress_mb_s': raw_bytes / 1e6 / max(sum(decompress), 1e-9),
+		'compress_p50_ms': percentile_ms(compress, 50),
+		'compress_p99_ms': percentile_ms(compress, 99),
+		'decompress_p50_ms': percentile_ms(decompress, 50),
+		'decompress_p99_ms': percentile_ms(decompress, 99),
+		'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base,
+	}
+
+def child(queue, args):
+	try:
+		queue.put(run_case(*args))
+	except Exception, e:
+		queue.put({'error': str(e)})
+
+# Run one case in a fresh process so its peak memory is its own
+def run_isolated(*args):
+	queue = multiprocessing.Queue()
+	process = multiprocessing.Process(target=child, args=(queue, args))
+	process.start()
+	result = queue.get()
+	process.join()
+	return result
+
+def main(argv):
+	parser = argparse.ArgumentParser(description="Benchmark point cloud compression offline.")
+	parser.add_argument('--sizes', default='160x120,320x240,640x480', help="synthetic frame sizes, WxH")
+	parser.add_argument('--frames', type=int, default=20, help="frames per case")
+	parser.add_argument('--modes', default=','.join(sorted(codec.MODES)))
+	parser.add_argument('--codecs', default='zlib')
+	parser.add_argument('--level', type=int, default=6)
+	parser.add_argument('--resolution', type=float, default=0.001)
+	parser.add_argument('--log', help="benchmark the frames of a recorded log instead")
+	parser.add_argument('--output', help="also append the results to this file")
+	args = parser.parse_args(argv)
+
+	if args.log:
+		sets = [(args.log, log_frames(args.log, args.frames))]
+	else:
+		sets = []
+		for size in args.sizes.split(','):
+			width, height = [int(n) for n in size.split('x')]
+			sets.append((size, synthetic.frames(args.frames, height, width)))
+
+	output = args.output and open(args.output, 'a')
+	for source, clouds in sets:
+		for mode in args.modes.split(','):
+			for codec_name in args.codecs.split(','):
+				result = run_isolated(clouds, mode, codec_name, args.level, {'resolution': args.resolution})
+				result['source'] = source
+				line = json.dumps(result, sort_keys=True)
+				print line
+				sys.stdout.flush()
+				if output:
+					output.write(line + '\n')
+	if output:
+		output.close()
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,57 @@
+"""
+Reusable byte buffers for serializing and (de)compressing point clouds.
+
+A Buffer grows to the largest frame it has held and is then reused, so in
+steady state a frame costs no large allocations: messages serialize straight
+into it, and streaming compressors are fed read-only chunks of it and write
+their output into another one.  ThreadBuffers keeps one set per thread, as
+the compressor may run several workers.
+"""
+import threading
+
+CHUNK = 1 << 16
+
+class Buffer(object):
+	def __init__(self, size=0):
+		self.data = bytearray(size)
+		self.length = 0
+
+	# Make room for size bytes in total, keeping what was written
+	def reserve(self, size):
+		if size > len(self.data):
+			self.data.extend(bytearray(max(size, 2 * len(self.data)) - len(self.data)))
+
+	def clear(self):
+		self.length = 0
+
+	# File-like write, so messages can serialize() into the buffer
+	def write(self, s):
+		end = self.length + len(s)
+		self.reserve(end)
+		self.data[self.length:end] = s
+		self.length = end
+
+	# Read-only view of the bytes written so far
+	def view(self, start=0):
+		return buffer(self.data, start, self.length - start)
+
+# Buffers created on first use, one set per thread: buffers.<name>
+class ThreadBuffers(threading.local):
+	def __getattr__(self, name):
+		if name.startswith('__'):
+			raise AttributeError(name)
+		buf = Buffer()
+		setattr(self, name, buf)
+		return buf
+
+# Feed data through a compressobj-like object chunk by chunk into out
+def compress_into(compressor, data, out):
+	for start in xrange(0, len(data), CHUNK):
+		out.write(compressor.compress(buffer(data, start, CHUNK)))
+	out.write(compressor.flush())
+
+def decompress_into(decompressor, data, out):
+	for start in xrange(0, len(data), CHUNK):
+		out.write(decompressor.decompress(buffer(data, start, CHUNK)))
+	if hasattr(decompressor, 'flush'):
+		out.write(decompressor.flush())
@@ -0,0 +1,94 @@
+"""
+Helpers for looking at the data of a sensor_msgs/PointCloud2 through NumPy.
+
+The data buffer is viewed in place as a structured array described by the
+cloud's fields, so nothing is copied until a codec actually needs to.
+"""
+import numpy as np
+from sensor_msgs.msg import PointCloud2
+from sensor_msgs.msg import PointField
+
+# PointField datatype -> NumPy type code, and back
+FIELD_TYPES = {
+	PointField.INT8: 'i1',
+	PointField.UINT8: 'u1',
+	PointField.INT16: 'i2',
+	PointField.UINT16: 'u2',
+	PointField.INT32: 'i4',
+	PointField.UINT32: 'u4',
+	PointField.FLOAT32: 'f4',
+	PointField.FLOAT64: 'f8',
+}
+DATATYPES = dict((v, k) for k, v in FIELD_TYPES.items())
+
+XYZ = ('x', 'y', 'z')
+
+# Build the structured dtype of one point from a list of PointFields
+def cloud_dtype(fields, point_step, is_bigendian=False):
+	order = is_bigendian and '>' or '<'
+	names, formats, offsets = [], [], []
+	for f in fields:
+		fmt = order + FIELD_TYPES[f.datatype]
+		if f.count > 1:
+			fmt = (fmt, f.count)
+		names.append(f.name)
+		formats.append(fmt)
+		offsets.append(f.offset)
+	return np.dtype({'names': names, 'formats': formats,
+			'offsets': offsets, 'itemsize': point_step})
+
+# View the cloud data as a (height, width) structured array without copying
+def cloud_array(cloud):
+	dtype = cloud_dtype(cloud.fields, cloud.point_step, cloud.is_bigendian)
+	return np.ndarray((cloud.height, cloud.width), dtype, buffer=cloud.data,
+			strides=(cloud.row_step, cloud.point_step))
+
+# Same dtype with only the given fields, laid out back to back in offset order
+def packed_dtype(dtype, names=None):
+	if names is None:
+		names = dtype.names
+	names = sorted([n for n in dtype.names if n in names],
+			key=lambda n: dtype.fields[n][1])
+	return np.dtype([(n, dtype.fields[n][0].newbyteorder('<')) for n in names])
+
+# Copy the given fields of a structured array into a packed array
+def repack(points, names=None):
+	out = np.empty(points.shape, packed_dtype(points.dtype, names))
+	for name in out.dtype.names:
+		out[name] = points[name]
+	return out
+
+def has_xyz(dtype):
+	return dtype.names is not None and all([n in dtype.names for n in XYZ])
+
+# Points whose x, y and z are all finite
+def valid_mask(points):
+	return np.isfinite(points['x']) & np.isfinite(points['y']) & np.isfinite(points['z'])
+
+def fields_from_dtype(dtype):
+	fields = []
+	for name in dtype.names:
+		sub, offset = dtype.fields[name][:2]
+		count = 1
+		if sub.subdtype is not None:
+			sub, shape = sub.subdtype
+			count = int(np.prod(shape))
+		fields.append(PointField(name=name, offset=offset,
+				datatype=DATATYPES[sub.str[1:]], count=count))
+	return fields
+
+# Wrap a little endian structured array of shape (height, width) or (n,) in a PointCloud2
+def array_to_cloud(points, header, is_dense=False):
+	cloud = PointCloud2()
+	cloud.header = header
+	if points.ndim == 1:
+		cloud.height, cloud.width = 1, points.shape[0]
+	else:
+		cloud.height, cloud.width = points.shape
+	cloud.fields = fields_from_dtype(points.dtype)
+	cloud.is_bigendian = False
+	cloud.point_step = points.dtype.itemsize
+	cloud.row_step = cloud.point_step * cloud.width
+	cloud.data = np.ascontiguousarray(points).tostring()
+	cloud.is_dense = is_dense
+	return cloud
@@ -0,0 +1,132 @@
+"""
+Append-only log files of compressed point clouds with a timestamp index.
+
+A log is a magic string followed by frames, each a small header (tag, stamp,
+size) and the compressed message data as published by compress.py.  Every
+chunk frames an index chunk is appended listing their stamps and offsets and
+linking back to the previous index chunk; closing the log writes a footer
+pointing at the last one.  A reader therefore loads the whole index without
+touching the frames, and falls back to hopping over the frame headers when
+the recording was not closed cleanly.  Frames are read from a memory map, so
+logs larger than RAM can be replayed.
+"""
+import os
+import errno
+import struct
+import mmap
+import numpy as np
+
+MAGIC = 'PCLOG01\n'
+# 'FRME', stamp, data size
+FRAME = struct.Struct('<4sdI')
+# 'INDX', number of entries, offset of the previous index chunk (0 for none)
+INDEX = struct.Struct('<4sIQ')
+# 'FOOT', offset of the last index chunk
+FOOTER = struct.Struct('<4sQ')
+ENTRY = np.dtype([('stamp', '<f8'), ('offset', '<u8')])
+
+class LogWriter(object):
+	# An existing file is only replaced with overwrite set
+	def __init__(self, path, chunk=100, overwrite=False):
+		flags = os.O_WRONLY | os.O_CREAT | (overwrite and os.O_TRUNC or os.O_EXCL)
+		try:
+			fd = os.open(path, flags, 0644)
+		except OSError, e:
+			if e.errno == errno.EEXIST:
+				raise IOError(errno.EEXIST, "point cloud log exists already, not overwriting it", path)
+			raise
+		self.file = os.fdopen(fd, 'wb')
+		self.file.write(MAGIC)
+		self.chunk = chunk
+		self.entries = []
+		self.last_index = 0
+
+	def write(self, stamp, data):
+		offset = self.file.tell()
+		self.file.write(FRAME.pack('FRME', stamp, len(data)))
+		self.file.write(data)
+		self.entries.append((stamp, offset))
+		if len(self.entries) >= self.chunk:
+			self.write_index()
+
+	def write_index(self):
+		if not self.entries:
+			return
+		offset = self.file.tell()
+		self.file.write(INDEX.pack('INDX', len(self.entries), self.last_index))
+		self.file.write(np.array(self.entries, ENTRY).tostring())
+		self.last_index = offset
+		self.entries = []
+		self.file.flush()
+
+	def close(self):
+		self.write_index()
+		self.file.write(FOOTER.pack('FOOT', self.last_index))
+		self.file.close()
+
+class LogReader(object):
+	def __init__(self, path):
+		self.file = open(path, 'rb')
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		if self.map[:len(MAGIC)] != MAGIC:
+			raise ValueError("%s is not a point cloud log" % path)
+		index = self.read_index()
+		if index is None:
+			index = self.scan()
+		self.index = index[np.argsort(index['stamp'], kind='mergesort')]
+
+	# Follow the index chunks back from the footer, None without a footer
+	def read_index(self):
+		end = len(self.map) - FOOTER.size
+		if end < len(MAGIC):
+			return None
+		tag, offset = FOOTER.unpack_from(self.map, end)
+		if tag != 'FOOT':
+			return None
+		chunks = []
+		while offset:
+			tag, count, previous = INDEX.unpack_from(self.map, offset)
+			chunks.append(np.frombuffer(self.map, ENTRY, count, offset + INDEX.size))
+			offset = previous
+		chunks.reverse()
+		return np.concatenate(chunks or [np.empty(0, ENTRY)])
+
+	# Hop over the frame headers, stopping at a truncated frame
+	def scan(self):
+		entries = []
+		offset = len(MAGIC)
+		while offset + FRAME.size <= len(self.map):
+			tag = self.map[offset:offset + 4]
+			if tag == 'FRME':
+				tag, stamp, size = FRAME.unpack_from(self.map, offset)
+				if offset + FRAME.size + size > len(self.map):
+					break
+				entries.append((stamp, offset))
+				offset += FRAME.size + size
+			elif tag == 'INDX':
+				tag, count, previous = INDEX.unpack_from(self.map, offset)
+				offset += INDEX.size + count * ENTRY.itemsize
+			else:
+				break
+		return np.array(entries, ENTRY)
+
+	def __len__(self):
+		return len(self.index)
+
+	def stamps(self):
+		return self.index['stamp']
+
+	# Position of the first frame at or after stamp, O(log n)
+	def seek(self, stamp):
+		return int(np.searchsorted(self.index['stamp'], stamp))
+
+	# Stamp and data of the i-th frame in stamp order
+	def frame(self, i):
+		offset = int(self.index['offset'][i])
+		tag, stamp, size = FRAME.unpack_from(self.map, offset)
+		start = offset + FRAME.size
+		return stamp, self.map[start:start + size]
+
+	def close(self):
+		self.map.close()
+		self.file.close()
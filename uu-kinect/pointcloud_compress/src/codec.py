@@ -0,0 +1,199 @@
+"""
+Codec registry shared by compress.py and decompress.py.
+
+A compressed cloud is a small fixed header followed by the compressed
+payload.  The header names the cloud mode (how the PointCloud2 is turned
+into bytes) and the byte codec (how those bytes are compressed) together
+with its level, so the decompressor needs no configuration.
+"""
+import struct
+import time
+import collections
+import zlib
+import bz2
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+from sensor_msgs.msg import PointCloud2
+import buffers
+import quantize
+import keyframe
+import depth_image
+import float_planes
+import octree
+
+# magic, version, mode, codec, level, stamp secs, stamp nsecs, payload size
+HEADER = struct.Struct('<3sB12s8sbIII')
+MAGIC = 'PCC'
+VERSION = 1
+
+FrameHeader = collections.namedtuple('FrameHeader', 'mode codec level secs nsecs size')
+
+# Byte codecs: name -> (compress(data, level), decompress(data))
+CODECS = {}
+
+def register_codec(name, compress, decompress):
+	CODECS[name] = (compress, decompress)
+
+def _bz2_compress(data, level):
+	return bz2.compress(data, min(max(level, 1), 9))
+
+def _lzma_compress(data, level):
+	return lzma.compress(data, preset=min(max(level, 0), 9))
+
+# Streaming codecs: name -> (compressobj(level), decompressobj()), see buffers.py
+STREAMS = {}
+
+def register_stream(name, compressobj, decompressobj):
+	STREAMS[name] = (compressobj, decompressobj)
+
+def _bz2_compressobj(level):
+	return bz2.BZ2Compressor(min(max(level, 1), 9))
+
+def _lzma_compressobj(level):
+	return lzma.LZMACompressor(preset=min(max(level, 0), 9))
+
+register_codec('none', lambda data, level: str(data), str)
+register_codec('zlib', zlib.compress, zlib.decompress)
+register_codec('bz2', _bz2_compress, bz2.decompress)
+register_stream('zlib', zlib.compressobj, zlib.decompressobj)
+register_stream('bz2', _bz2_compressobj, bz2.BZ2Decompressor)
+if lzma is not None:
+	register_codec('lzma', _lzma_compress, lzma.decompress)
+	register_stream('lzma', _lzma_compressobj, lzma.LZMADecompressor)
+
+# The serialized PointCloud2 message, as the original compressor sent it
+class RawMode(object):
+	def __init__(self, params={}):
+		self.buffers = buffers.ThreadBuffers()
+
+	# Serialized into this thread's reusable buffer, valid until its next encode
+	def encode(self, cloud):
+		buf = self.buffers.serialized
+		buf.clear()
+		cloud.serialize(buf)
+		return buf.view()
+
+	def decode(self, payload):
+		cloud = PointCloud2()
+		cloud.deserialize(payload)
+		return cloud
+
+# Cloud modes: name -> class taking a parameter dict, with encode(cloud) and decode(payload).
+# decode() may return None when the payload cannot be used (e.g. a delta without its keyframe).
+# Modes whose encoding depends on earlier frames set stateful = True.
+MODES = {}
+
+def register_mode(name, cls):
+	MODES[name] = cls
+
+register_mode('raw', RawMode)
+register_mode('quantized', quantize.QuantizedMode)
+register_mode('keyframe', keyframe.KeyframeMode)
+register_mode('depth', depth_image.DepthMode)
+register_mode('lossless', float_planes.LosslessMode)
+register_mode('octree', octree.OctreeMode)
+
+def make_mode(name, params={}):
+	if name not in MODES:
+		raise ValueError("unknown point cloud mode '%s', have %s" % (name, sorted(MODES)))
+	return MODES[name](params)
+
+# Compress a mode payload and put the header in front of it
+def pack(mode, codec, level, stamp, payload):
+	if codec not in CODECS:
+		raise ValueError("unknown codec '%s', have %s" % (codec, sorted(CODECS)))
+	data = CODECS[codec][0](payload, level)
+	return HEADER.pack(MAGIC, VERSION, mode, codec, level,
+			stamp.secs, stamp.nsecs, len(payload)) + data
+
+# Same as pack(), streaming the compressed data into a reusable buffer
+def pack_into(out, mode, codec, level, stamp, payload):
+	if codec not in CODECS:
+		raise ValueError("unknown codec '%s', have %s" % (codec, sorted(CODECS)))
+	out.clear()
+	out.write(HEADER.pack(MAGIC, VERSION, mode, codec, level,
+			stamp.secs, stamp.nsecs, len(payload)))
+	if codec in STREAMS:
+		buffers.compress_into(STREAMS[codec][0](level), payload, out)
+	else:
+		out.write(CODECS[codec][0](payload, level))
+	return out.view()
+
+def is_packed(data):
+	return data[:len(MAGIC)] == MAGIC
+
+def unpack_header(data):
+	magic, version, mode, codec, level, secs, nsecs, size = HEADER.unpack_from(data)
+	if magic != MAGIC or version != VERSION:
+		raise ValueError("not a compressed point cloud (version %d)" % version)
+	return FrameHeader(mode.rstrip('\0'), codec.rstrip('\0'), level, secs, nsecs, size)
+
+# Returns the header and the decompressed mode payload
+def unpack(data):
+	header = unpack_header(data)
+	if header.codec not in CODECS:
+		raise ValueError("codec '%s' is not available here" % header.codec)
+	return header, CODECS[header.codec][1](buffer(data, HEADER.size))
+
+# Same as unpack(), the payload is a view of out, valid until out is reused
+def unpack_into(out, data):
+	header = unpack_header(data)
+	if header.codec not in CODECS:
+		raise ValueError("codec '%s' is not available here" % header.codec)
+	out.clear()
+	out.reserve(header.size)
+	if header.codec in STREAMS:
+		buffers.decompress_into(STREAMS[header.codec][1](), buffer(data, HEADER.size), out)
+	else:
+		out.write(CODECS[header.codec][1](buffer(data, HEADER.size)))
+	return header, out.view()
+
+# Benchmarks the registered codecs on the first few frames and picks one.
+# With a bandwidth budget the cheapest codec that fits is chosen (or the
+# smallest if none does), otherwise the one saving most bytes per ms.
+# Candidates are timed by the wall clock (time.clock() would count the other
+# threads too), so run add() where it competes with as little as possible.
+class CodecSelector(object):
+	def __init__(self, frames=3, max_kbps=0, hz=1, levels=(1, 6, 9)):
+		self.frames = frames
+		self.max_kbps = max_kbps
+		self.hz = hz
+		self.candidates = [(c, l) for c in sorted(CODECS) if c != 'none' for l in levels]
+		self.input_bytes = 0
+		self.output_bytes = dict((c, 0) for c in self.candidates)
+		self.cpu = dict((c, 0.0) for c in self.candidates)
+		self.seen = 0
+		self.choice = None
+
+	# Time every candidate on one payload, returns the choice once made;
+	# hz is the measured frame rate, if known
+	def add(self, payload, hz=0):
+		if hz > 0:
+			self.hz = hz
+		for codec, level in self.candidates:
+			start = time.time()
+			size = len(CODECS[codec][0](payload, level))
+			self.cpu[codec, level] += time.time() - start
+			self.output_bytes[codec, level] += size
+		self.input_bytes += len(payload)
+		self.seen += 1
+		if self.seen >= self.frames:
+			self.choice = self.choose()
+		return self.choice
+
+	def kbps(self, candidate):
+		return self.output_bytes[candidate] * 8.0 * self.hz / self.seen / 1000.0
+
+	def choose(self):
+		if self.max_kbps > 0:
+			fits = [c for c in self.candidates if self.kbps(c) <= self.max_kbps]
+			if fits:
+				return min(fits, key=lambda c: self.cpu[c])
+			return min(self.candidates, key=lambda c: self.output_bytes[c])
+		return max(self.candidates, key=lambda c:
+				(self.input_bytes - self.output_bytes[c]) / max(self.cpu[c] * 1000.0, 1e-3))
@@ -0,0 +1,136 @@
+"""
+Colour planes for the packed rgb/rgba field of a point cloud.
+
+Interleaved with x/y/z, the float32 rgb field breaks up every match zlib
+could find, so the quantized and depth modes code colour on its own: the
+channels become separate 8 bit planes, each stored as differences between
+neighbouring pixels along a row (smooth surfaces give small, repeating
+values).  Optionally the planes are
+
+  reduced to colour_bits bits per channel (4-6 bits look fine on a screen);
+  converted to YCbCr ('yuv'), which puts most of the detail in Y;
+  converted to YCbCr with the chroma planes at half resolution ('yuv420'),
+    averaged over 2x2 pixels of organized clouds, or over pairs of
+    neighbouring points of unorganized ones.
+
+8 bit 'rgb' is lossless.  The alpha byte is kept, as a single value when it
+is the same for all points (as for Kinect clouds).
+"""
+import struct
+import numpy as np
+
+COLOUR_FIELDS = ('rgb', 'rgba')
+FORMATS = {'rgb': 0, 'yuv': 1, 'yuv420': 2}
+RGB, YUV, YUV420 = 0, 1, 2
+# format, bits per channel, alpha stored as a plane, constant alpha
+HEADER = struct.Struct('<BBBB')
+
+def colour_field(dtype):
+	for name in COLOUR_FIELDS:
+		if name in dtype.names:
+			return name
+	return None
+
+# Scale 8 bit values to bits bits and back, rounding to the nearest level
+def reduce(plane, bits):
+	if bits >= 8:
+		return plane.astype(np.uint8)
+	top = (1 << bits) - 1
+	return ((plane.astype(np.uint32) * top + 127) // 255).astype(np.uint8)
+
+def expand(plane, bits):
+	if bits >= 8:
+		return plane
+	top = (1 << bits) - 1
+	return ((plane.astype(np.uint32) * 255 + top // 2) // top).astype(np.uint8)
+
+# Differences along the last axis, modulo 256, and their running sum
+def delta(plane):
+	out = plane.copy()
+	out[..., 1:] -= plane[..., :-1]
+	return out
+
+def undelta(plane):
+	return np.cumsum(plane, axis=-1, dtype=np.uint8)
+
+# Halve the resolution: 2x2 blocks of an image, pairs of a sequence
+def subsample(plane):
+	plane = plane.astype(np.float32)
+	if plane.ndim == 1:
+		if len(plane) % 2:
+			plane = np.r_[plane, plane[-1:]]
+		return (plane[0::2] + plane[1::2]) / 2
+	if plane.shape[0] % 2:
+		plane = np.vstack([plane, plane[-1:]])
+	if plane.shape[1] % 2:
+		plane = np.hstack([plane, plane[:, -1:]])
+	return (plane[0::2, 0::2] + plane[1::2, 0::2] + plane[0::2, 1::2] + plane[1::2, 1::2]) / 4
+
+def upsample(plane, shape):
+	if len(shape) == 1:
+		return plane.repeat(2)[:shape[0]]
+	return plane.repeat(2, 0).repeat(2, 1)[:shape[0], :shape[1]]
+
+def half_shape(shape):
+	return tuple([(n + 1) // 2 for n in shape])
+
+def to_byte(plane):
+	return np.clip(np.round(plane), 0, 255).astype(np.uint8)
+
+# Colour planes of an array of packed 0xAARRGGBB values (2-D or 1-D)
+def encode(packed, bits=8, format='rgb'):
+	packed = np.ascontiguousarray(packed).view(np.uint32)
+	kind = FORMATS[format]
+	bits = min(max(bits, 1), 8)
+	r, g, b = [((packed >> shift) & 0xff).astype(np.float32) for shift in (16, 8, 0)]
+	if kind == RGB:
+		planes = [r, g, b]
+	else:
+		y = 0.299 * r + 0.587 * g + 0.114 * b
+		cb = 128 - 0.168736 * r - 0.331264 * g + 0.5 * b
+		cr = 128 + 0.5 * r - 0.418688 * g - 0.081312 * b
+		if kind == YUV420:
+			cb, cr = subsample(cb), subsample(cr)
+		planes = [y, cb, cr]
+	alpha = (packed >> 24).astype(np.uint8)
+	constant = alpha.size == 0 or (alpha == alpha.flat[0]).all()
+	value = alpha.size and int(alpha.flat[0]) or 0
+	data = [delta(reduce(to_byte(p), bits)).tostring() for p in planes[:3]]
+	if not constant:
+		data.append(delta(alpha).tostring())
+	return HEADER.pack(kind, bits, not constant, value) + ''.join(data)
+
+# Packed colours of the given shape from data at offset, and the offset after them
+def decode(data, shape, offset=0):
+	kind, bits, has_alpha, value = HEADER.unpack_from(data, offset)
+	offset += HEADER.size
+	planes = []
+	for i in range(3):
+		plane_shape = shape
+		if kind == YUV420 and i > 0:
+			plane_shape = half_shape(shape)
+		n = int(np.prod(plane_shape))
+		plane = np.frombuffer(data, np.uint8, n, offset).reshape(plane_shape)
+		planes.append(expand(undelta(plane), bits).astype(np.float32))
+		offset += n
+	if kind == RGB:
+		r, g, b = planes
+	else:
+		y, cb, cr = planes
+		if kind == YUV420:
+			cb, cr = upsample(cb, shape), upsample(cr, shape)
+		cb -= 128
+		cr -= 128
+		r = y + 1.402 * cr
+		g = y - 0.344136 * cb - 0.714136 * cr
+		b = y + 1.772 * cb
+	if has_alpha:
+		n = int(np.prod(shape))
+		alpha = undelta(np.frombuffer(data, np.uint8, n, offset).reshape(shape)).astype(np.uint32)
+		offset += n
+	else:
+		alpha = np.uint32(value)
+	packed = alpha << 24
+	for plane, shift in ((r, 16), (g, 8), (b, 0)):
+		packed = packed | (to_byte(plane).astype(np.uint32) << shift)
+	return np.asarray(packed, np.uint32).reshape(shape), offset
@@ -4,60 +4,288 @@ import rospy
 from std_msgs.msg import ByteMultiArray
 from std_msgs.msg import MultiArrayDimension
 from sensor_msgs.msg import PointCloud2
-import cStringIO
-import zlib
+from pointcloud_compress.msg import ShmFrame
 import thread
+import time
+import codec
+import buffers
+import pipeline
+import voxel_grid
+import roi_filter
+import shm_transport
+import fragment
+import telemetry
+import bandwidth
 
 class Compressor:
-	def __init__(self, node):
+	# ns is where the parameters live, falling back to the node's own (~);
+	# with a shared worker pool every frame is compressed, at most at ~hz
+	def __init__(self, node, ns='~', pool=None):
 		self.node = node
+		self.ns = ns
 
 		# Get the parameters
-		self.input_cloud = rospy.get_param("~input",'/camera/depth/points2')
-		self.output_cloud= rospy.get_param("~output", '/camera/depth/points2_compressed')
-		self.compress_hz = rospy.get_param("~hz",1)
-		self.compress_level= rospy.get_param("~level",6)
+		self.input_cloud = self.param("input", '/camera/depth/points2')
+		self.output_cloud= self.param("output", '/camera/depth/points2_compressed')
+		self.compress_hz = self.param("hz", 1)
+		self.compress_level= self.param("level", 6)
+		self.mode = self.param("mode", 'raw')	# see codec.MODES
+		self.codec = self.param("codec", 'zlib')	# see codec.CODECS, or auto
+		self.max_kbps = self.param("max_kbps", 0)	# bandwidth budget for auto and adaptive, 0 for none
+		self.adaptive = self.param("adaptive", False)	# adjust settings at runtime to stay within ~max_kbps
+		self.voxel_size = self.param("voxel_size", 0.0)	# metres, 0 keeps full resolution
+		drop_fields = self.param("drop_fields", [])	# e.g. [rgb], or a comma separated string
+		if isinstance(drop_fields, basestring):
+			drop_fields = [f.strip() for f in drop_fields.split(',') if f.strip()]
+		self.roi = roi_filter.RoiFilter(
+				self.param("crop_min", None),	# [x, y, z] metres, corner of the crop box
+				self.param("crop_max", None),
+				self.param("crop_frame", ''),	# frame of the crop box, default the cloud's
+				self.param("max_range", 0.0),	# metres from the sensor, 0 for no limit
+				drop_fields,
+				self.param("drop_padding", False))	# pack the point records
+		self.workers = self.param("workers", 0)	# >0 compresses every new frame on a pool instead of at ~hz
+		self.fragment_size = self.param("fragment_size", 0)	# bytes, >0 streams frames out in fragments
+		if pool is not None:
+			self.workers = len(pool.threads)
+		self.params = {
+			'resolution': self.param("resolution", 0.001),	# metres, quantized mode
+			'keyframe_interval': self.param("keyframe_interval", 10),	# keyframe mode
+			'delta_threshold': self.param("delta_threshold", 0.01),	# metres, keyframe mode
+			'colour_threshold': self.param("colour_threshold", 8),	# levels per 8 bit colour channel, keyframe mode
+			'depth_rgb': self.param("depth_rgb", True),	# send the colour planes, depth mode
+			'colour_bits': self.param("colour_bits", 8),	# bits per colour channel, quantized and depth modes
+			'colour_format': self.param("colour_format", 'rgb'),	# or yuv, or yuv420 (chroma at half resolution)
+			'octree_depth': self.param("octree_depth", 10),	# octree mode
+			'octree_base': self.param("octree_base", 6),	# levels in the first layer, octree mode
+		}
+		self.layer_topics = self.param("layer_topics", False)	# octree refinement layers on <output>_level<n>
+		self.encoder = codec.make_mode(self.mode, self.params)
+		self.selector = None
+		if self.codec == 'auto':
+			self.selector = codec.CodecSelector(self.param("auto_frames", 3), self.max_kbps, self.compress_hz)
+			self.codec = 'zlib'	# until the benchmark is done
 
 		# Friendly info
 		rospy.loginfo("Point Cloud Compressor started.")
 		rospy.loginfo("Point Cloud Compressor listening:   %s.",self.input_cloud)
 		rospy.loginfo("Point Cloud Compressor publishing:  %s.",self.output_cloud)
 		rospy.loginfo("Point Cloud Compressor compression: %d.",self.compress_level)
-		rospy.loginfo("Point Cloud Compressor frequency:   %d.",self.compress_hz)
+		if self.workers > 0:
+			rospy.loginfo("Point Cloud Compressor workers:     %d.",self.workers)
+		else:
+			rospy.loginfo("Point Cloud Compressor frequency:   %d.",self.compress_hz)
+		rospy.loginfo("Point Cloud Compressor mode:        %s.",self.mode)
+		rospy.loginfo("Point Cloud Compressor codec:       %s.",self.selector and 'auto' or self.codec)
+		if self.voxel_size > 0:
+			rospy.loginfo("Point Cloud Compressor voxel size:  %g.",self.voxel_size)
+		if self.fragment_size > 0:
+			rospy.loginfo("Point Cloud Compressor fragments:   %d bytes.",self.fragment_size)
+		if self.roi.active():
+			rospy.loginfo("Point Cloud Compressor region:      box %s to %s in %s, range %g, dropping %s.",
+					self.roi.crop_min, self.roi.crop_max, self.roi.crop_frame or 'cloud frame',
+					self.roi.max_range, sorted(self.roi.drop_fields) or 'no fields')
 
 		self.compressed_msg = ByteMultiArray()
 		self.compressed_msg.layout.dim.append(MultiArrayDimension())
-		rospy.Subscriber(self.input_cloud, PointCloud2, self.receive_cloud)
 		self.publisher = rospy.Publisher(self.output_cloud,ByteMultiArray)
-		self.buf=None #cStringIO.StringIO()
+		self.layer_publishers = [self.publisher]
+		self.fragmenter = None
+		if self.fragment_size > 0:
+			self.fragmenter = fragment.Fragmenter(self.fragment_size)
+		self.shm = None
+		segment = self.param("shm_segment", '')	# also hand clouds to local consumers in /dev/shm/<segment>
+		if segment:
+			self.shm = shm_transport.ShmWriter(segment, self.param("shm_slots", 4),
+					self.param("shm_slot_size", 12 << 20))
+			self.shm_publisher = rospy.Publisher(self.output_cloud + "_shm", ShmFrame)
+			# copied on a thread of its own, the newest cloud replacing one still waiting
+			self.shm_pipeline = pipeline.Pipeline(self.shm.write, self.share, 1)
+			rospy.on_shutdown(self.shm_pipeline.stop)
+			rospy.on_shutdown(self.shm.close)
+			rospy.loginfo("Point Cloud Compressor shared memory: %s on %s_shm.",segment,self.output_cloud)
+		if self.layer_topics and hasattr(self.encoder, 'encode_layers'):
+			for level in self.encoder.levels[1:]:
+				self.layer_publishers.append(rospy.Publisher("%s_level%d" % (self.output_cloud, level), ByteMultiArray))
+		self.cloud=None
+		self.fresh = False	# the stored cloud has not been compressed yet
 		self.lock=thread.allocate_lock()
+		self.select_lock=thread.allocate_lock()
+		self.trying = False	# a codec trial is running
+		self.buffers = buffers.ThreadBuffers()
+		self.telemetry = telemetry.Telemetry(self.ns + "stats", self.param("stats_window", 100),
+				self.param("stats_period", 1.0))
+		self.pipeline = None
+		if self.workers > 0:
+			# stateful modes encode one frame at a time, in order, and so
+			# do fragmented streams so the fragments of frames do not mix
+			self.pipeline = pipeline.Pipeline(self.compress, self.publish, self.workers, self.telemetry.drop,
+					pool, getattr(self.encoder, 'stateful', False) or self.fragment_size > 0)
+		self.max_hz = 0	# pipelined rate limit, ~hz on a shared pool, else set by the bandwidth controller
+		if pool is not None:
+			self.max_hz = self.compress_hz
+		self.base_max_hz = self.max_hz
+		self.last_submit = 0
+		self.controller = None
+		if self.adaptive and self.max_kbps > 0:
+			hz = self.pipeline and (self.max_hz or self.param("input_hz", 30)) or self.compress_hz
+			start = bandwidth.Setting(self.compress_level, hz, self.voxel_size, self.params['resolution'])
+			self.controller = bandwidth.BandwidthController(self, self.max_kbps, start,
+					self.mode in ('quantized', 'depth'))
+
+		# last, receive_cloud needs everything above
+		rospy.Subscriber(self.input_cloud, PointCloud2, self.receive_cloud)
 
-	# When a point cloud is received, serialise it and store it
+	def param(self, name, default):
+		return rospy.get_param(self.ns + name, rospy.get_param("~" + name, default))
+
+	# When a point cloud is received, store it (or hand it to the pool)
 	def receive_cloud(self, data):
+		if self.shm is not None:
+			self.shm_pipeline.submit(data)
+		if self.pipeline is not None:
+			now = time.time()
+			if self.max_hz and now - self.last_submit < 1.0 / self.max_hz:
+				self.telemetry.drop()
+				return
+			self.last_submit = now
+			self.pipeline.submit(data)
+			return
 		self.lock.acquire() 		# lock mutex - maybe we have a thread
-		self.buf = cStringIO.StringIO()  # store it in buffer
-		data.serialize(self.buf)
+		if self.fresh:
+			self.telemetry.drop()
+		self.cloud = data
+		self.fresh = True
+		self.lock.release()
+
+	# Clouds go to the local consumers uncompressed, whatever the rate limit;
+	# frame is what ShmWriter.write returned
+	def share(self, frame):
+		if frame is None:
+			rospy.logwarn("Point Cloud Compressor: cloud does not fit a %d byte shared memory slot.",self.shm.slot_size)
+			return
+		self.shm_publisher.publish(frame)
+
+	# Reduce the cloud before it is encoded
+	def filter(self, cloud):
+		cloud = self.roi.filter(cloud)
+		if self.voxel_size > 0:
+			cloud = voxel_grid.voxel_filter(cloud, self.voxel_size)
+		return cloud
+
+	# Filter and encode the cloud with the configured mode, then compress it with the codec;
+	# returns the messages to publish, several (one per layer) for progressive modes.
+	# Fragments are sent while compressing, nothing is left to publish then.
+	def compress(self, cloud):
+		start = time.time()
+		if hasattr(self.encoder, 'encode_layers'):
+			payloads = self.encoder.encode_layers(self.filter(cloud))
+		else:
+			payloads = [self.encoder.encode(self.filter(cloud))]
+		if self.selector is not None:
+			self.select(payloads)
+		if self.fragmenter is not None:
+			sent = 0
+			spent = [0.0]	# publishing the fragments, as publish() records it
+			for i, payload in enumerate(payloads):
+				publisher = self.layer_publishers[min(i, len(self.layer_publishers) - 1)]
+				sent += self.fragmenter.send(lambda data: self.send_timed(publisher, data, spent), self.mode,
+						self.codec, self.compress_level, cloud.header.stamp, payload)
+			self.telemetry.record(len(cloud.data), sent, time.time() - start - spent[0], cloud.header.stamp)
+			self.telemetry.record_publish(spent[0])
+			return []	# already sent
+		stuffed = [str(codec.pack_into(self.buffers.packed, self.mode, self.codec,
+				self.compress_level, cloud.header.stamp, payload)) for payload in payloads]
+		self.telemetry.record(len(cloud.data), sum(map(len, stuffed)), time.time() - start, cloud.header.stamp)
+		return stuffed
+
+	# The benchmark takes seconds per frame, so a copy of the frame is tried on
+	# a thread of its own; frames that come meanwhile are not tried
+	def select(self, payloads):
+		self.select_lock.acquire()
+		try:
+			if self.selector is None or self.trying:
+				return
+			self.trying = True
+			payload = ''.join([str(p) for p in payloads])	# raw mode payloads are buffers
+			thread.start_new_thread(self.trial, (self.selector, payload))
+		finally:
+			self.select_lock.release()
+
+	# Rates the codecs for the measured frame rate, then switches to the choice
+	def trial(self, selector, payload):
+		try:
+			choice = selector.add(payload, self.telemetry.rate())
+		finally:
+			self.select_lock.acquire()
+			self.trying = False
+			if selector.choice is not None:
+				self.selector = None
+			self.select_lock.release()
+		if choice is None:
+			return
+		self.lock.acquire()
+		self.codec, self.compress_level = choice
+		self.lock.release()
+		rospy.loginfo("Point Cloud Compressor picked codec %s, level %d.",self.codec,self.compress_level)
+
+	# Publish the messages of a frame, layers beyond the last topic go on the last one
+	def publish(self, stuffed):
+		start = time.time()
+		for i, data in enumerate(stuffed):
+			self.send(self.layer_publishers[min(i, len(self.layer_publishers) - 1)], data)
+		if stuffed:
+			self.telemetry.record_publish(time.time() - start)
+
+	def send(self, publisher, data):
+		self.compressed_msg.data=data
+		self.compressed_msg.layout.dim[0].size=len(data)
+		publisher.publish(self.compressed_msg)
+
+	# Send, adding the time it took to spent[0]
+	def send_timed(self, publisher, data, spent):
+		start = time.time()
+		self.send(publisher, data)
+		spent[0] += time.time() - start
+
+	# Take new settings from the bandwidth controller
+	def apply(self, setting):
+		self.lock.acquire()
+		self.compress_level = setting.level
+		self.voxel_size = setting.voxel_size
+		if self.pipeline is not None:
+			self.max_hz = setting.hz < self.controller.steps[0].hz and setting.hz or self.base_max_hz
+		else:
+			self.compress_hz = setting.hz
+		if setting.resolution != self.params['resolution']:
+			self.params['resolution'] = setting.resolution
+			self.encoder = codec.make_mode(self.mode, self.params)
 		self.lock.release()
 
 
 if __name__ == '__main__':
 	node = rospy.init_node('cloud_compressor',anonymous=True)
 	c = Compressor(node)
-	rate = rospy.Rate(c.compress_hz)
-	while not rospy.is_shutdown():
-		rate.sleep()
-		if c.buf == None:
-			continue
-
-		c.lock.acquire()
-		stuffed = zlib.compress(c.buf.getvalue(),c.compress_level)
-#		print len(c.buf.getvalue()), " ==> ", len(stuffed)
-		c.compressed_msg.data=stuffed
-		c.compressed_msg.layout.dim[0].size=len(stuffed)
-		c.publisher.publish(c.compressed_msg)
-	
-		c.lock.release()
-
-	rospy.spin()
+	if c.pipeline is not None:
+		rospy.spin()
+		c.pipeline.stop()
+	else:
+		hz = c.compress_hz
+		rate = rospy.Rate(hz)
+		while not rospy.is_shutdown():
+			if hz != c.compress_hz:	# changed by the bandwidth controller
+				hz = c.compress_hz
+				rate = rospy.Rate(hz)
+			rate.sleep()
+			if c.cloud == None:
+				continue
+
+			c.lock.acquire()
+			cloud = c.cloud
+			c.fresh = False
+			c.lock.release()
+			c.publish(c.compress(cloud))
+
+		rospy.spin()
 
 
@@ -4,35 +4,173 @@ import rospy
 from std_msgs.msg import ByteMultiArray
 from std_msgs.msg import MultiArrayDimension
 from sensor_msgs.msg import PointCloud2
-import cStringIO
 import zlib
+import time
+import threading
+import codec
+import buffers
+import telemetry
+import pipeline
+import fragment
+import octree
+import shm_transport
 
 class Decompressor:
-	def __init__(self, node):
+	def __init__(self, node, subscribe=True):
 		self.node = node
 		
 		# Get the parameters
 		self.input_cloud = rospy.get_param("~input",'/camera/depth/points2_compressed')
 		self.output_cloud= rospy.get_param("~output", '/camera/depth/points2_decompressed')
+		self.max_level = rospy.get_param("~max_level", 0)	# octree mode: stop refining here, 0 for all levels
+		self.layer_topics = rospy.get_param("~layer_topics", False)	# octree layers on <input>_level<n>
+		self.octree_base = rospy.get_param("~octree_base", 6)	# as the compressor's, its layer topics start above it
+		self.workers = rospy.get_param("~workers", 2)	# decode threads, 0 decodes in the callback
+		self.max_age = rospy.get_param("~max_age", 0.0)	# seconds, older frames are skipped, 0 for no limit
+		self.shm = rospy.get_param("~shm", False)	# same host: take the clouds from the compressor's shared memory (<input>_shm)
+		if not subscribe:	# fed by a caller (replay) that paces itself, with old stamps
+			self.workers = self.max_age = 0
 
 		# Friendly info
 		rospy.loginfo("Point Cloud Decompressor started.")
 		rospy.loginfo("Point Cloud Decompressor listening:   %s.",self.input_cloud)
 		rospy.loginfo("Point Cloud Deompressor publishing:  %s.",self.output_cloud)
+		if self.workers > 0:
+			rospy.loginfo("Point Cloud Decompressor workers:     %d.",self.workers)
+		if self.max_age > 0:
+			rospy.loginfo("Point Cloud Decompressor max age:     %g.",self.max_age)
+		if self.shm and subscribe:
+			rospy.loginfo("Point Cloud Decompressor shared memory: %s_shm.",self.input_cloud)
 		
-		self.decompressed_msg = PointCloud2()
-		rospy.Subscriber(self.input_cloud, ByteMultiArray, self.receive_cloud)
+		self.modes = {}
+		self.params = {'max_level': self.max_level}
+		self.lock = threading.Lock()	# stateful modes decode one frame at a time
+		self.buffers = buffers.ThreadBuffers()
+		self.telemetry = telemetry.Telemetry("~stats", rospy.get_param("~stats_window", 100),
+				rospy.get_param("~stats_period", 1.0))
+		self.reassemblers = {}	# topic -> fragment.Reassembler
+		self.pipeline = None
+		if self.workers > 0:
+			self.pipeline = pipeline.Pipeline(self.decode, self.publish, self.workers, self.telemetry.drop)
 		self.publisher = rospy.Publisher(self.output_cloud,PointCloud2)
+		if subscribe and self.shm:
+			shm_transport.ShmSubscriber(self.input_cloud + "_shm", self.receive_shared, self.telemetry.drop)
+		elif subscribe:
+			rospy.Subscriber(self.input_cloud, ByteMultiArray, self.receive_cloud, self.input_cloud)
+			if self.layer_topics:
+				for level in range(self.octree_base + 1, (self.max_level or octree.MAX_DEPTH) + 1):
+					topic = "%s_level%d" % (self.input_cloud, level)
+					rospy.Subscriber(topic, ByteMultiArray, self.receive_cloud, topic)
 
 	# When a point cloud is received, decompress and deserialise it and publish it again.
-	def receive_cloud(self, data):
-		self.decompressed_msg.deserialize(zlib.decompress(data.data))
-		self.publisher.publish(self.decompressed_msg)
+	# Stateless modes are decoded on the pool, where a frame still waiting when the
+	# next one arrives is dropped; frames of stateful modes (keyframe deltas, octree
+	# layers) are all needed, in order, and are decoded right here.
+	def receive_cloud(self, data, topic=None):
+		if fragment.is_fragment(data.data):
+			self.receive_fragment(data.data, topic)
+			return
+		frame = (data.data, time.time())
+		header = codec.is_packed(data.data) and codec.unpack_header(data.data) or None
+		if self.stale(header):
+			self.telemetry.drop()
+			return
+		if self.pipeline is None or header is None or self.stateful(header.mode):
+			self.publish(self.decode(frame))
+		else:
+			self.pipeline.submit(frame)
+
+	# Clouds from shared memory are whole and uncompressed, only the age counts
+	def receive_shared(self, cloud):
+		if self.max_age > 0 and time.time() - cloud.header.stamp.to_sec() > self.max_age:
+			self.telemetry.drop()
+			return
+		self.telemetry.record(len(cloud.data), len(cloud.data), 0.0, cloud.header.stamp)
+		self.publisher.publish(cloud)
+
+	# Fragments are reassembled (and decompressed) as they come in, per topic
+	def receive_fragment(self, data, topic):
+		if topic not in self.reassemblers:
+			self.reassemblers[topic] = fragment.Reassembler()
+		reassembler = self.reassemblers[topic]
+		dropped = reassembler.dropped
+		try:
+			frame = reassembler.add(data)
+		except ValueError, e:
+			rospy.logwarn("Point Cloud Decompressor: bad fragment: %s", e)
+			frame = None
+		if reassembler.dropped > dropped:
+			self.telemetry.drop(reassembler.dropped - dropped)
+		if frame is None:
+			return
+		header, payload, size = frame
+		if self.stale(header):
+			self.telemetry.drop()
+			return
+		start = time.time()
+		cloud = self.decode_payload(header, payload)
+		if cloud is not None:
+			self.telemetry.record(len(cloud.data), size, time.time() - start, cloud.header.stamp)
+		self.publish(cloud)
+
+	# Whether the frame is older than ~max_age (legacy frames carry no stamp)
+	def stale(self, header):
+		if self.max_age <= 0 or header is None:
+			return False
+		return time.time() - (header.secs + header.nsecs * 1e-9) > self.max_age
+
+	def stateful(self, mode):
+		return getattr(codec.MODES.get(mode), 'stateful', False)
+
+	# Decompress a (data, arrival time) frame, None if it is dropped
+	def decode(self, frame):
+		data, arrival = frame
+		if self.max_age > 0 and codec.is_packed(data) and self.stale(codec.unpack_header(data)):
+			return None	# went stale waiting for a worker
+		start = time.time()
+		cloud = self.decompress(data)
+		if cloud is not None:
+			self.telemetry.record(len(cloud.data), len(data), time.time() - start, cloud.header.stamp)
+		return cloud
+
+	# The decoded cloud keeps the header (and stamp) it was compressed with
+	def publish(self, cloud):
+		if cloud is None:
+			self.telemetry.drop()
+			return
+		self.publisher.publish(cloud)
+
+	# The header names the mode and codec; plain zlib is what older compressors sent
+	def decompress(self, data):
+		if not codec.is_packed(data):
+			cloud = PointCloud2()
+			cloud.deserialize(zlib.decompress(data))
+			return cloud
+		header, payload = codec.unpack_into(self.buffers.payload, data)
+		return self.decode_payload(header, payload)
+
+	def decode_payload(self, header, payload):
+		self.lock.acquire()
+		try:
+			if header.mode not in self.modes:
+				self.modes[header.mode] = codec.make_mode(header.mode, self.params)
+			mode = self.modes[header.mode]
+		finally:
+			self.lock.release()
+		if not getattr(mode, 'stateful', False):
+			return mode.decode(payload)
+		self.lock.acquire()
+		try:
+			return mode.decode(payload)
+		finally:
+			self.lock.release()
 
 if __name__ == '__main__':
 	node = rospy.init_node('cloud_decompressor',anonymous=True)
 	c = Decompressor(node)
 	
 	rospy.spin()
+	if c.pipeline is not None:
+		c.pipeline.stop()
 
 
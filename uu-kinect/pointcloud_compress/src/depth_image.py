@@ -0,0 +1,122 @@
+"""
+Depth image mode for organized point clouds.
+
+An organized cloud from a depth camera is a pinhole reprojection of its depth
+image, so x/y carry no information beyond z and the camera intrinsics.  The
+intrinsics are fitted from the cloud itself (u = fx * x/z + cx, likewise for
+v), and the cloud is sent as a 16 bit depth plane in units of resolution
+metres plus, when the cloud has colour, colour planes (see colour.py).
+Clouds that are unorganized or do not fit a pinhole model within
+max_reprojection pixels fall back to quantized mode.
+
+The decoded cloud is organized, with NaN for missing depth, and has the
+fields x, y, z and rgb when colour was sent.
+"""
+import struct
+import numpy as np
+from sensor_msgs.msg import PointCloud2
+import cloud_fields
+import quantize
+import colour
+
+PLANES = 0
+QUANTIZED = 1
+# fx, fy, cx, cy, resolution, colour
+INTRINSICS = struct.Struct('<5dB')
+# how colour is sent: not at all, as 8 bit R, G and B planes (older payloads), or by colour.py
+NO_COLOUR, RGB_PLANES, COLOUR_PLANES = 0, 1, 2
+
+# Least squares fit of pixel = f * ratio + c, returns (f, c, worst residual in pixels)
+def fit_axis(ratio, pixel):
+	if len(ratio) < 2 or np.ptp(ratio) == 0:
+		return None
+	f, c = np.polyfit(ratio, pixel, 1)
+	return f, c, np.abs(f * ratio + c - pixel).max()
+
+class DepthMode(object):
+	def __init__(self, params={}):
+		self.resolution = params.get('resolution', 0.001)
+		self.colour = params.get('depth_rgb', True)
+		self.colour_bits = params.get('colour_bits', 8)
+		self.colour_format = params.get('colour_format', 'rgb')
+		self.max_reprojection = params.get('max_reprojection', 0.5)	# pixels
+		self.sample = params.get('intrinsics_sample', 5000)	# points used for the fit
+		self.grids = {}
+
+	def intrinsics(self, points):
+		v, u = np.nonzero(cloud_fields.valid_mask(points) & (points['z'] > 0))
+		if len(u) > self.sample:
+			pick = np.linspace(0, len(u) - 1, self.sample).astype(int)
+			v, u = v[pick], u[pick]
+		z = points['z'][v, u]
+		fit_u = fit_axis(points['x'][v, u] / z, u)
+		fit_v = fit_axis(points['y'][v, u] / z, v)
+		if fit_u is None or fit_v is None or max(fit_u[2], fit_v[2]) > self.max_reprojection:
+			return None
+		return fit_u[0], fit_v[0], fit_u[1], fit_v[1]
+
+	def encode(self, cloud):
+		points = None
+		if cloud.height > 1:
+			points = cloud_fields.cloud_array(cloud)
+		camera = None
+		if points is not None and cloud_fields.has_xyz(points.dtype):
+			camera = self.intrinsics(points)
+		if camera is None:
+			return chr(QUANTIZED) + quantize.encode(cloud, self.resolution, self.colour_bits, self.colour_format)
+
+		valid = cloud_fields.valid_mask(points) & (points['z'] > 0)
+		depth = np.zeros(points.shape, np.uint16)
+		depth[valid] = np.minimum(np.round(points['z'][valid] / self.resolution), 0xffff)
+
+		name = self.colour and colour.colour_field(points.dtype) or None
+		layout = [(axis, '<f4') for axis in cloud_fields.XYZ]
+		planes = [depth.tostring()]
+		if name:
+			layout.append(('rgb', '<f4'))
+			planes.append(colour.encode(points[name], self.colour_bits, self.colour_format))
+		layout = np.dtype(layout)
+		meta = PointCloud2(header=cloud.header, height=cloud.height, width=cloud.width,
+				fields=cloud_fields.fields_from_dtype(layout), is_bigendian=False,
+				point_step=layout.itemsize, row_step=layout.itemsize * cloud.width, is_dense=False)
+		fx, fy, cx, cy = camera
+		return ''.join([chr(PLANES), quantize.pack_meta(meta),
+				INTRINSICS.pack(fx, fy, cx, cy, self.resolution, name and COLOUR_PLANES or NO_COLOUR)] + planes)
+
+	# Pixel coordinates of an image, kept between frames of the same size
+	# Decoded on worker threads too, so self.grids is only replaced, never read twice
+	def grid(self, height, width):
+		grid = self.grids.get((height, width))
+		if grid is None:
+			grid = np.mgrid[0:height, 0:width].astype(np.float32)
+			self.grids = {(height, width): grid}
+		return grid
+
+	def decode(self, payload):
+		if ord(payload[0]) == QUANTIZED:
+			return quantize.decode(buffer(payload, 1))
+		cloud, offset = quantize.unpack_meta(payload, 1)
+		fx, fy, cx, cy, resolution, colour_kind = INTRINSICS.unpack_from(payload, offset)
+		offset += INTRINSICS.size
+		shape = (cloud.height, cloud.width)
+		n = cloud.height * cloud.width
+
+		depth = np.frombuffer(payload, np.uint16, n, offset).reshape(shape)
+		offset += depth.nbytes
+		v, u = self.grid(*shape)
+		points = np.empty(shape, cloud_fields.cloud_dtype(cloud.fields, cloud.point_step))
+		z = depth * np.float32(resolution)
+		z[depth == 0] = np.nan
+		points['x'] = (u - np.float32(cx)) * z / np.float32(fx)
+		points['y'] = (v - np.float32(cy)) * z / np.float32(fy)
+		points['z'] = z
+		if colour_kind == COLOUR_PLANES:
+			points['rgb'] = colour.decode(payload, shape, offset)[0].view(np.float32)
+		elif colour_kind == RGB_PLANES:
+			rgb = np.zeros(shape, np.uint32)
+			for shift in (16, 8, 0):
+				rgb |= np.frombuffer(payload, np.uint8, n, offset).reshape(shape).astype(np.uint32) << shift
+				offset += n
+			points['rgb'] = rgb.view(np.float32)
+		cloud.data = points.tostring()
+		return cloud
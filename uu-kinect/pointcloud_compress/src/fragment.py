@@ -0,0 +1,131 @@
+"""
+Fragmentation of compressed point clouds into fixed size messages.
+
+A frame as codec.pack() would produce it (header and compressed payload) is
+instead sent as fragments of fragment_size bytes, each behind a small
+FRAGMENT header.  The payload goes through a streaming compressor chunk by
+chunk and a fragment is sent as soon as enough compressed bytes are there,
+so the first bytes leave while most of the cloud is still being compressed
+and no complete compressed frame is ever held.
+
+The Reassembler feeds fragments into a streaming decompressor as they come
+in, so by the time the last fragment arrives only its own bytes are left to
+decompress.  A missing or out of order fragment drops the frame.
+"""
+import struct
+import itertools
+import codec
+import buffers
+
+# magic, version, frame id, fragment index, offset in the frame, last fragment
+FRAGMENT = struct.Struct('<3sBIIIB')
+MAGIC = 'PCF'
+VERSION = 1
+
+def is_fragment(data):
+	return data[:len(MAGIC)] == MAGIC
+
+class Fragmenter(object):
+	# send(data) publishes one fragment
+	def __init__(self, fragment_size=1 << 16):
+		self.fragment_size = max(fragment_size, codec.HEADER.size + 1)
+		self.frames = itertools.count(1)
+
+	# Compress a mode payload and send it as fragments, returns the bytes sent
+	def send(self, send, mode, codec_name, level, stamp, payload):
+		if codec_name not in codec.CODECS:
+			raise ValueError("unknown codec '%s', have %s" % (codec_name, sorted(codec.CODECS)))
+		frame = self.frames.next() & 0xffffffff
+		state = {'pending': [codec.HEADER.pack(codec.MAGIC, codec.VERSION, mode, codec_name, level,
+				stamp.secs, stamp.nsecs, len(payload))], 'size': 0, 'index': 0, 'offset': 0, 'sent': 0}
+		state['size'] = len(state['pending'][0])
+		if codec_name in codec.STREAMS:
+			compressor = codec.STREAMS[codec_name][0](level)
+			for start in xrange(0, len(payload), buffers.CHUNK):
+				self.add(send, frame, state, compressor.compress(buffer(payload, start, buffers.CHUNK)))
+			self.add(send, frame, state, compressor.flush())
+		else:
+			self.add(send, frame, state, codec.CODECS[codec_name][0](payload, level))
+		self.emit(send, frame, state, ''.join(state['pending']), True)
+		return state['sent']
+
+	# Queue compressed bytes, sending every full fragment
+	def add(self, send, frame, state, data):
+		if not data:
+			return
+		state['pending'].append(data)
+		state['size'] += len(data)
+		if state['size'] < self.fragment_size:
+			return
+		data = ''.join(state['pending'])
+		end = len(data) - len(data) % self.fragment_size
+		for start in xrange(0, end, self.fragment_size):
+			self.emit(send, frame, state, data[start:start + self.fragment_size], False)
+		state['pending'] = [data[end:]]
+		state['size'] = len(data) - end
+
+	def emit(self, send, frame, state, data, last):
+		fragment = FRAGMENT.pack(MAGIC, VERSION, frame, state['index'], state['offset'], last) + data
+		send(fragment)
+		state['index'] += 1
+		state['offset'] += len(data)
+		state['sent'] += len(fragment)
+
+# Rebuilds frames from fragments.  add() returns (header, payload, compressed
+# bytes) when a frame is complete; the payload is a view of a buffer that is
+# reused for the next frame.
+class Reassembler(object):
+	def __init__(self):
+		self.frame = None
+		self.payload = buffers.Buffer()
+		self.dropped = 0
+
+	def add(self, data):
+		magic, version, frame, index, offset, last = FRAGMENT.unpack_from(data)
+		if version != VERSION:
+			raise ValueError("point cloud fragment version %d, expected %d" % (version, VERSION))
+		data = buffer(data, FRAGMENT.size)
+		if index == 0:
+			if self.frame is not None:
+				self.dropped += 1	# never completed
+			self.start(frame, data)
+		elif self.frame is None or frame != self.frame['id'] or index != self.frame['next'] \
+				or offset != self.frame['offset']:
+			if self.frame is not None:
+				self.dropped += 1
+				self.frame = None
+			return None
+		else:
+			self.feed(data)
+		self.frame['next'] = index + 1
+		self.frame['offset'] = offset + len(data)
+		self.frame['bytes'] += FRAGMENT.size + len(data)
+		if not last:
+			return None
+		state, self.frame = self.frame, None
+		if state['decompressor'] is not None:
+			if hasattr(state['decompressor'], 'flush'):
+				self.payload.write(state['decompressor'].flush())
+		else:
+			self.payload.write(codec.CODECS[state['header'].codec][1](''.join(state['pending'])))
+		return state['header'], self.payload.view(), state['bytes']
+
+	# First fragment: the codec header and the start of the compressed data
+	def start(self, frame, data):
+		header = codec.unpack_header(data)
+		if header.codec not in codec.CODECS:
+			raise ValueError("codec '%s' is not available here" % header.codec)
+		decompressor = None
+		if header.codec in codec.STREAMS:
+			decompressor = codec.STREAMS[header.codec][1]()
+		self.frame = {'id': frame, 'header': header, 'decompressor': decompressor,
+				'pending': [], 'next': 0, 'offset': 0, 'bytes': 0}
+		self.payload.clear()
+		self.payload.reserve(header.size)
+		self.feed(buffer(data, codec.HEADER.size))
+
+	def feed(self, data):
+		if self.frame['decompressor'] is not None:
+			self.payload.write(self.frame['decompressor'].decompress(data))
+		else:
+			self.frame['pending'].append(str(data))
@@ -0,0 +1,120 @@
+"""
+Keyframe + delta mode for PointCloud2 streams of a fixed layout.
+
+Every keyframe_interval-th frame is sent whole (serialized as in raw mode).
+The frames in between only carry the points whose x/y/z moved more than
+delta_threshold metres (or became valid/invalid), whose colour channels
+changed by more than colour_threshold levels, or whose other fields changed
+at all since the last frame, as a bitmask plus the full records of those
+points.  Unchanged points keep the
+values the decoder already has, so the encoder tracks exactly what the
+decoder holds and errors do not accumulate.
+
+Deltas must be decoded in sequence: after a dropped message the decoder
+returns None until the next keyframe arrives.
+"""
+import struct
+import numpy as np
+import cloud_fields
+import colour
+import quantize
+
+KEY = 0
+DELTA = 1
+# frame type, keyframe id, frame index since that keyframe
+HEADER = struct.Struct('<BII')
+
+# The point records of a cloud as an (n, point_step) byte array copy
+def records(cloud):
+	rows = np.frombuffer(cloud.data, np.uint8).reshape(cloud.height, cloud.row_step)
+	return rows[:, :cloud.width * cloud.point_step].reshape(-1, cloud.point_step).copy()
+
+def layout(cloud):
+	return (cloud.height, cloud.width, cloud.point_step, cloud.is_bigendian,
+			tuple([(f.name, f.offset, f.datatype, f.count) for f in cloud.fields]))
+
+class KeyframeMode(object):
+	# Encoding depends on the previous frame, frames must be encoded one at a time
+	stateful = True
+
+	def __init__(self, params={}):
+		self.interval = params.get('keyframe_interval', 10)
+		self.threshold = params.get('delta_threshold', 0.01)
+		self.colour_threshold = params.get('colour_threshold', 8)
+		self.key_id = 0
+		self.index = 0
+		self.layout = None
+		self.reference = None
+		self.dtype = None
+		self.colour = None	# byte offset of the packed colour field
+		self.other = None	# bytes of the remaining fields
+
+	def encode(self, cloud):
+		if self.layout != layout(cloud) or self.index + 1 >= self.interval:
+			return self.encode_key(cloud)
+		current = records(cloud)
+		changed = self.changed(current)
+		self.reference[changed] = current[changed]
+		self.index += 1
+		return ''.join([HEADER.pack(DELTA, self.key_id, self.index), quantize.pack_meta(cloud),
+				np.packbits(changed).tostring(), current[changed].tostring()])
+
+	def encode_key(self, cloud):
+		self.key_id += 1
+		self.index = 0
+		self.layout = layout(cloud)
+		self.reference = records(cloud)
+		self.dtype = cloud_fields.cloud_dtype(cloud.fields, cloud.point_step, cloud.is_bigendian)
+		name = colour.colour_field(self.dtype)
+		self.colour = name and self.dtype.fields[name][1]
+		self.other = np.zeros(cloud.point_step, bool)
+		for name in self.dtype.names:
+			if name not in cloud_fields.XYZ and name not in colour.COLOUR_FIELDS:
+				kind, offset = self.dtype.fields[name][:2]
+				self.other[offset:offset + kind.itemsize] = True
+		payload = quantize.pack_meta(cloud) + self.reference.tostring()
+		return HEADER.pack(KEY, self.key_id, self.index) + payload
+
+	# Points to resend: geometry moved or colour changed beyond the thresholds,
+	# validity or any other field changed
+	def changed(self, current):
+		if not cloud_fields.has_xyz(self.dtype):
+			return (current != self.reference).any(axis=1)
+		now = current.view(self.dtype).ravel()
+		then = self.reference.view(self.dtype).ravel()
+		changed = cloud_fields.valid_mask(now) != cloud_fields.valid_mask(then)
+		olderr = np.seterr(invalid='ignore')	# NaN points compare as unchanged
+		try:
+			for axis in cloud_fields.XYZ:
+				changed |= np.abs(now[axis] - then[axis]) > self.threshold
+		finally:
+			np.seterr(**olderr)
+		if self.colour is not None:
+			channels = slice(self.colour, self.colour + 4)
+			difference = current[:, channels].astype(np.int16) - self.reference[:, channels]
+			changed |= (np.abs(difference) > self.colour_threshold).any(axis=1)
+		if self.other.any():
+			changed |= (current[:, self.other] != self.reference[:, self.other]).any(axis=1)
+		return changed
+
+	def decode(self, payload):
+		kind, key_id, index = HEADER.unpack_from(payload)
+		cloud, offset = quantize.unpack_meta(payload, HEADER.size)
+		n = cloud.height * cloud.width
+		if kind == KEY:
+			self.reference = np.frombuffer(payload, np.uint8, n * cloud.point_step, offset)
+			self.reference = self.reference.reshape(n, cloud.point_step).copy()
+		elif key_id != self.key_id or index != self.index + 1 or self.reference is None:
+			self.reference = None	# lost our reference, wait for the next keyframe
+			return None
+		else:
+			mask = np.frombuffer(payload, np.uint8, (n + 7) // 8, offset)
+			changed = np.unpackbits(mask)[:n].astype(bool)
+			offset += mask.nbytes
+			count = int(changed.sum())
+			self.reference[changed] = np.frombuffer(payload, np.uint8,
+					count * cloud.point_step, offset).reshape(count, cloud.point_step)
+		self.key_id, self.index = key_id, index
+		cloud.row_step = cloud.width * cloud.point_step
+		cloud.data = self.reference.tostring()
+		return cloud
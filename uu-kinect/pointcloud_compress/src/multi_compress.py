@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('pointcloud_compress')
+import rospy
+import pipeline
+from compress import Compressor
+
+# Compresses several point cloud streams in one process on a shared worker
+# pool.  Each stream is configured under ~streams/<name>/ with the same
+# parameters as compress.py (input, output, mode, codec, level, hz, ...);
+# anything not set there is taken from the node's own parameters.  On the
+# shared pool every stream compresses each new frame, at most at its hz.
+#
+#   streams:
+#     kinect_head: {input: /head/depth/points2, output: /head/points2_compressed, codec: zlib, hz: 5}
+#     kinect_arm:  {input: /arm/depth/points2, output: /arm/points2_compressed, mode: depth, hz: 2}
+if __name__ == '__main__':
+	node = rospy.init_node('multi_cloud_compressor',anonymous=True)
+	streams = rospy.get_param("~streams", {})
+	if not streams:
+		rospy.logerr("Multi Point Cloud Compressor: no ~streams configured.")
+	pool = pipeline.WorkerPool(rospy.get_param("~workers", 2))
+	rospy.loginfo("Multi Point Cloud Compressor: %d streams on %d workers.",len(streams),len(pool.threads))
+	compressors = [Compressor(node, '~streams/%s/' % name, pool) for name in sorted(streams)]
+
+	rospy.spin()
+	pool.stop()
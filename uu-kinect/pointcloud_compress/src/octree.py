@@ -0,0 +1,181 @@
+"""
+Progressive octree mode: a coarse cloud first, detail later.
+
+The valid points are put in a cube around them that is split octree_depth
+times.  Each level of the octree is coded breadth first as one occupancy
+byte per occupied node of the level above (bit i set when child i holds
+points), nodes in Morton order.  Only geometry is kept: the decoded cloud
+holds the x/y/z centres of the occupied cells of the deepest level received.
+
+The levels are cut into layers: the first carries levels 1..octree_base
+(plus the cloud metadata and the cube), every further layer one more level.
+compress.py publishes the layers as separate messages, coarse first, so a
+subscriber can show something after the first few kB and can stop at any
+level (max_level) to save bandwidth and CPU.
+
+Layers may arrive out of order when published on topics of their own; the
+decoder holds them back until the layers before them are in, and forgets a
+frame when the first layer of a newer one arrives.
+"""
+import struct
+import itertools
+import numpy as np
+from sensor_msgs.msg import PointCloud2
+import cloud_fields
+import quantize
+
+LAYER = 0
+LAYERS = 1
+KIND = struct.Struct('<B')
+# kind, frame id, layer index, deepest level in the layer
+HEADER = struct.Struct('<BIBB')
+# origin x, y, z, cube size, octree depth (0 for an empty cloud)
+CUBE = struct.Struct('<4dB')
+LENGTH = quantize.LENGTH
+MAX_DEPTH = 21	# three 21 bit coordinates fill a 64 bit Morton code
+MAX_PENDING = 64
+XYZ_DTYPE = np.dtype([(axis, '<f4') for axis in cloud_fields.XYZ])
+
+# Spread the low 21 bits of x so there are two zero bits between them
+def spread(x):
+	x = x.astype(np.uint64) & np.uint64(0x1fffff)
+	for shift, mask in ((32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+			(4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)):
+		x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+	return x
+
+def compact(x):
+	x = x & np.uint64(0x1249249249249249)
+	for shift, mask in ((2, 0x10c30c30c30c30c3), (4, 0x100f00f00f00f00f), (8, 0x1f0000ff0000ff),
+			(16, 0x1f00000000ffff), (32, 0x1fffff)):
+		x = (x | (x >> np.uint64(shift))) & np.uint64(mask)
+	return x
+
+def morton(ix, iy, iz):
+	return (spread(ix) << np.uint64(2)) | (spread(iy) << np.uint64(1)) | spread(iz)
+
+# The cube around the valid points and the occupancy bytes of every level, root first
+def build(cloud, depth):
+	points = cloud_fields.cloud_array(cloud).ravel()
+	points = points[cloud_fields.valid_mask(points)]
+	if not len(points):
+		return (0.0, 0.0, 0.0), 0.0, []
+	xyz = np.array([points[axis] for axis in cloud_fields.XYZ], np.float64)
+	low = xyz.min(axis=1)
+	size = max((xyz.max(axis=1) - low).max(), 1e-6) * (1 + 1e-6)
+	cells = 1 << depth
+	index = np.minimum((xyz - low[:, None]) / size * cells, cells - 1).astype(np.uint64)
+	nodes = np.unique(morton(*index))
+
+	levels = []
+	for level in range(depth):
+		parents = nodes >> np.uint64(3)
+		starts = np.flatnonzero(np.r_[True, parents[1:] != parents[:-1]])
+		bits = np.left_shift(1, (nodes & np.uint64(7)).astype(np.uint8))
+		levels.append(np.bitwise_or.reduceat(bits, starts).astype(np.uint8))
+		nodes = parents[starts]
+	levels.reverse()
+	return tuple(low), size, levels
+
+# The nodes of the next level from the occupancy bytes of the current one
+def expand(nodes, occupancy):
+	bits = np.unpackbits(occupancy[:, None], axis=1)[:, ::-1]
+	rows, children = np.nonzero(bits)
+	return (nodes[rows] << np.uint64(3)) | children.astype(np.uint64)
+
+# Cell centres of the nodes of a level
+def centres(nodes, level, origin, size):
+	cell = size / (1 << level)
+	xyz = np.empty(len(nodes), XYZ_DTYPE)
+	for i, axis in enumerate(cloud_fields.XYZ):
+		xyz[axis] = origin[i] + (compact(nodes >> np.uint64(2 - i)).astype(np.float64) + 0.5) * cell
+	return xyz
+
+class OctreeMode(object):
+	# The decoder builds each frame up from several layers, in order
+	stateful = True
+
+	def __init__(self, params={}):
+		self.depth = max(1, min(params.get('octree_depth', 10), MAX_DEPTH))
+		self.base = max(1, min(params.get('octree_base', 6), self.depth))
+		self.max_level = params.get('max_level', 0) or MAX_DEPTH
+		self.frames = itertools.count(1)
+		# deepest level of every layer
+		self.levels = [self.base] + range(self.base + 1, self.depth + 1)
+		self.frame = None	# decoder state of the frame being built up
+		self.pending = {}
+
+	# One payload per layer, coarse first
+	def encode_layers(self, cloud):
+		frame = self.frames.next() & 0xffffffff
+		origin, size, levels = build(cloud, self.depth)
+		meta = PointCloud2(header=cloud.header, height=1, width=0,
+				fields=cloud_fields.fields_from_dtype(XYZ_DTYPE), is_bigendian=False,
+				point_step=XYZ_DTYPE.itemsize, row_step=0, is_dense=True)
+		first = [quantize.pack_meta(meta), CUBE.pack(origin[0], origin[1], origin[2], size, len(levels))]
+		if not levels:
+			return [HEADER.pack(LAYER, frame, 0, 0) + ''.join(first)]
+		layers = [first + [l.tostring() for l in levels[:self.base]]]
+		layers += [[l.tostring()] for l in levels[self.base:]]
+		return [HEADER.pack(LAYER, frame, i, self.levels[i]) + ''.join(layer)
+				for i, layer in enumerate(layers)]
+
+	# All layers in one payload, for logs and benchmarks
+	def encode(self, cloud):
+		layers = self.encode_layers(cloud)
+		return KIND.pack(LAYERS) + ''.join([LENGTH.pack(len(l)) + l for l in layers])
+
+	def decode(self, payload):
+		kind, = KIND.unpack_from(payload)
+		if kind == LAYER:
+			return self.decode_layer(payload)
+		cloud = None
+		offset = KIND.size
+		while offset < len(payload):
+			length, = LENGTH.unpack_from(payload, offset)
+			offset += LENGTH.size
+			cloud = self.decode_layer(payload[offset:offset + length]) or cloud
+			offset += length
+		return cloud
+
+	# Apply a layer, returns the cloud at the deepest level received so far,
+	# None when the layer could not be used (yet) or is beyond max_level
+	def decode_layer(self, payload):
+		kind, frame, index, last = HEADER.unpack_from(payload)
+		if index > 0 and last > self.max_level:
+			return None	# the first layer is decoded up to max_level
+		if index == 0:
+			if self.frame is not None and frame == self.frame['id']:
+				return None	# duplicate
+			meta, offset = quantize.unpack_meta(payload, HEADER.size)
+			x, y, z, size, depth = CUBE.unpack_from(payload, offset)
+			self.frame = {'id': frame, 'next': 1, 'meta': meta, 'origin': (x, y, z), 'size': size,
+					'level': 0, 'nodes': np.zeros(depth and 1 or 0, np.uint64)}
+			self.pending = dict((k, v) for k, v in self.pending.items() if k[0] == frame)
+			self.apply(last, buffer(payload, offset + CUBE.size))
+		elif self.frame is None or frame != self.frame['id']:
+			if len(self.pending) >= MAX_PENDING:
+				self.pending.clear()
+			self.pending[frame, index] = (last, payload[HEADER.size:])
+			return None
+		elif index != self.frame['next']:
+			self.pending[frame, index] = (last, payload[HEADER.size:])
+			return None
+		else:
+			self.apply(last, buffer(payload, HEADER.size))
+			self.frame['next'] += 1
+		while (frame, self.frame['next']) in self.pending:
+			self.apply(*self.pending.pop((frame, self.frame['next'])))
+			self.frame['next'] += 1
+		points = centres(self.frame['nodes'], self.frame['level'], self.frame['origin'], self.frame['size'])
+		return cloud_fields.array_to_cloud(points, self.frame['meta'].header, True)
+
+	# Expand the current frame by the levels of a layer
+	def apply(self, last, data):
+		last = min(last, self.max_level)
+		offset = 0
+		for level in range(self.frame['level'], last):
+			occupancy = np.frombuffer(data, np.uint8, len(self.frame['nodes']), offset)
+			offset += len(occupancy)
+			self.frame['nodes'] = expand(self.frame['nodes'], occupancy)
+		self.frame['level'] = max(last, self.frame['level'])
@@ -0,0 +1,122 @@
+"""
+Worker pool for compressing point clouds off the subscriber callback.
+
+Each Pipeline (one per input stream) keeps only the newest submitted frame:
+a frame replaced before any worker picked it up is dropped.  The workers of
+a WorkerPool compress frames in parallel (zlib and NumPy release the GIL),
+and each pipeline publishes its results in submission order; a result that
+finishes after a newer one was already published is dropped as stale.
+
+Several pipelines can share one pool.  A pipeline with a frame waiting is
+queued once, at the back, so streams are served round robin and a fast
+camera cannot starve a slow one.  Serial pipelines (stateful encoders) have
+at most one frame in flight.
+"""
+import threading
+import collections
+import rospy
+
+class WorkerPool(object):
+	def __init__(self, workers=2):
+		self.cond = threading.Condition()
+		self.ready = collections.deque()	# pipelines with a frame waiting
+		self.running = True
+		self.threads = []
+		for i in range(workers):
+			thread = threading.Thread(target=self.run, name='compress-%d' % i)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	def stop(self):
+		self.cond.acquire()
+		self.running = False
+		self.cond.notifyAll()
+		self.cond.release()
+
+	# Queue a pipeline that has a frame for us, called with cond held
+	def schedule(self, pipeline):
+		if pipeline.frame is None or pipeline.queued or (pipeline.serial and pipeline.busy):
+			return
+		pipeline.queued = True
+		self.ready.append(pipeline)
+		self.cond.notify()
+
+	def take(self):
+		self.cond.acquire()
+		try:
+			while not self.ready and self.running:
+				self.cond.wait()
+			if not self.running:
+				return None, None
+			pipeline = self.ready.popleft()
+			pipeline.queued = False
+			pipeline.busy += 1
+			frame, pipeline.frame = pipeline.frame, None
+			return pipeline, frame
+		finally:
+			self.cond.release()
+
+	def run(self):
+		while True:
+			pipeline, frame = self.take()
+			if pipeline is None:
+				return
+			try:
+				pipeline.process(*frame)
+			finally:
+				self.cond.acquire()
+				pipeline.busy -= 1
+				self.schedule(pipeline)
+				self.cond.release()
+
+class Pipeline(object):
+	def __init__(self, work, publish, workers=2, on_drop=None, pool=None, serial=False):
+		self.work = work
+		self.publish = publish
+		self.on_drop = on_drop
+		self.serial = serial
+		self.own_pool = pool is None
+		self.pool = pool or WorkerPool(workers)
+		self.publish_lock = threading.Lock()
+		self.frame = None	# (sequence, frame) waiting for a worker
+		self.queued = False
+		self.busy = 0	# frames being worked on
+		self.submitted = 0
+		self.published = 0
+		self.dropped = 0
+
+	# Hand over a new frame, replacing one no worker has taken yet
+	def submit(self, frame):
+		self.pool.cond.acquire()
+		if self.frame is not None:
+			self.drop()
+		self.submitted += 1
+		self.frame = (self.submitted, frame)
+		self.pool.schedule(self)
+		self.pool.cond.release()
+
+	def drop(self):
+		self.dropped += 1
+		if self.on_drop is not None:
+			self.on_drop()
+
+	def stop(self):
+		if self.own_pool:
+			self.pool.stop()
+
+	def process(self, seq, frame):
+		try:
+			result = self.work(frame)
+		except Exception, e:
+			rospy.logerr("Point cloud pipeline: frame %d failed: %s", seq, e)
+			return
+		self.publish_lock.acquire()
+		try:
+			if seq < self.published:
+				self.drop()
+				return
+			self.published = seq
+			self.publish(result)
+		finally:
+			self.publish_lock.release()
@@ -0,0 +1,115 @@
+"""
+Lossy geometry codec for PointCloud2.
+
+Invalid (NaN) points are dropped, x/y/z are quantized to a fixed resolution
+and stored as per-axis deltas between consecutive points, colour goes into
+planes of its own (see colour.py), and the remaining fields (intensity, ...)
+are stored packed without their padding.  The payload is meant to be handed
+to an entropy coder such as zlib.
+
+The decoded cloud is unorganized (height 1) and uses a packed point layout.
+"""
+import struct
+import cStringIO
+import numpy as np
+from sensor_msgs.msg import PointCloud2
+import cloud_fields
+import colour
+
+LENGTH = struct.Struct('<I')
+# resolution, number of points, bytes per delta | SPLIT_COLOUR
+HEADER = struct.Struct('<dIB')
+SPLIT_COLOUR = 0x80	# colour planes follow the other fields (older payloads have none)
+
+# Serialize the cloud metadata (header, fields, size) without its data, from a
+# copy: the cloud may be read by other streams meanwhile
+def pack_meta(cloud, row_step=None):
+	if row_step is None:
+		row_step = cloud.row_step
+	buf = cStringIO.StringIO()
+	PointCloud2(header=cloud.header, height=cloud.height, width=cloud.width, fields=cloud.fields,
+			is_bigendian=cloud.is_bigendian, point_step=cloud.point_step, row_step=row_step,
+			is_dense=cloud.is_dense).serialize(buf)
+	meta = buf.getvalue()
+	return LENGTH.pack(len(meta)) + meta
+
+# Returns the metadata-only cloud and the offset of what follows it
+def unpack_meta(payload, offset=0):
+	length, = LENGTH.unpack_from(payload, offset)
+	offset += LENGTH.size
+	cloud = PointCloud2()
+	cloud.deserialize(payload[offset:offset + length])
+	return cloud, offset + length
+
+# Quantize the valid points of a cloud, returns the (uncompressed) payload
+def encode(cloud, resolution=0.001, colour_bits=8, colour_format='rgb'):
+	points = cloud_fields.cloud_array(cloud).ravel()
+	points = points[cloud_fields.valid_mask(points)]
+	n = len(points)
+
+	deltas = np.empty((3, n), np.int64)
+	for i, axis in enumerate(cloud_fields.XYZ):
+		deltas[i] = np.round(points[axis] / resolution)
+	deltas[:, 1:] = np.diff(deltas, axis=1)
+	width = 2
+	if n and np.abs(deltas).max() >= 2**15:
+		width = 4
+		if np.abs(deltas).max() >= 2**31:
+			raise ValueError("cloud extent too large for a %g m resolution" % resolution)
+
+	layout = cloud_fields.packed_dtype(points.dtype)
+	separate = list(cloud_fields.XYZ)
+	planes = ''
+	name = colour.colour_field(layout)
+	if name is not None:
+		separate.append(name)
+		planes = colour.encode(points[name], colour_bits, colour_format)
+		width |= SPLIT_COLOUR
+	rest = cloud_fields.repack(points, [f for f in layout.names if f not in separate])
+	meta = PointCloud2(header=cloud.header, height=1, width=n,
+			fields=cloud_fields.fields_from_dtype(layout), is_bigendian=False,
+			point_step=layout.itemsize, row_step=layout.itemsize * n, is_dense=True)
+
+	return ''.join([pack_meta(meta), HEADER.pack(resolution, n, width),
+			deltas.astype('<i%d' % (width & ~SPLIT_COLOUR)).tostring(), rest.tostring(), planes])
+
+# Rebuild a PointCloud2 from a payload produced by encode()
+def decode(payload):
+	cloud, offset = unpack_meta(payload)
+	resolution, n, width = HEADER.unpack_from(payload, offset)
+	offset += HEADER.size
+	split, width = width & SPLIT_COLOUR, width & ~SPLIT_COLOUR
+
+	layout = cloud_fields.cloud_dtype(cloud.fields, cloud.point_step)
+	points = np.empty(n, layout)
+	if n:
+		deltas = np.frombuffer(payload, '<i%d' % width, 3 * n, offset).reshape(3, n)
+		offset += deltas.nbytes
+		for i, axis in enumerate(cloud_fields.XYZ):
+			points[axis] = np.cumsum(deltas[i], dtype=np.int64) * resolution
+		separate = list(cloud_fields.XYZ)
+		name = split and colour.colour_field(layout)
+		if name:
+			separate.append(name)
+		rest = cloud_fields.packed_dtype(layout, [f for f in layout.names if f not in separate])
+		if rest.names:
+			rest = np.frombuffer(payload, rest, n, offset)
+			offset += rest.nbytes
+			for field in rest.dtype.names:
+				points[field] = rest[field]
+		if name:
+			points[name] = colour.decode(payload, (n,), offset)[0].view(layout.fields[name][0])
+	cloud.data = points.tostring()
+	return cloud
+
+class QuantizedMode(object):
+	def __init__(self, params={}):
+		self.resolution = params.get('resolution', 0.001)
+		self.colour_bits = params.get('colour_bits', 8)
+		self.colour_format = params.get('colour_format', 'rgb')
+
+	def encode(self, cloud):
+		return encode(cloud, self.resolution, self.colour_bits, self.colour_format)
+
+	def decode(self, payload):
+		return decode(payload)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('pointcloud_compress')
+import rospy
+from std_msgs.msg import ByteMultiArray
+import codec
+import cloud_log
+
+# Appends the compressed clouds published by compress.py to a log file
+class Recorder:
+	def __init__(self, node):
+		self.node = node
+
+		# Get the parameters
+		self.input_cloud = rospy.get_param("~input",'/camera/depth/points2_compressed')
+		self.filename = rospy.get_param("~file", 'clouds.pclog')
+		self.chunk = rospy.get_param("~chunk", 100)	# frames per index chunk
+		self.overwrite = rospy.get_param("~overwrite", False)	# replace an existing ~file
+
+		# Friendly info
+		rospy.loginfo("Point Cloud Recorder started.")
+		rospy.loginfo("Point Cloud Recorder listening:   %s.",self.input_cloud)
+		rospy.loginfo("Point Cloud Recorder writing:     %s.",self.filename)
+
+		self.log = cloud_log.LogWriter(self.filename, self.chunk, self.overwrite)
+		self.frames = 0
+		rospy.Subscriber(self.input_cloud, ByteMultiArray, self.receive_cloud)
+		rospy.on_shutdown(self.close)
+
+	# Index by the cloud stamp when the frame carries one, else by arrival
+	def receive_cloud(self, data):
+		stamp = rospy.Time.now().to_sec()
+		if codec.is_packed(data.data):
+			header = codec.unpack_header(data.data)
+			if header.secs:
+				stamp = header.secs + header.nsecs * 1e-9
+		self.log.write(stamp, data.data)
+		self.frames += 1
+
+	def close(self):
+		self.log.close()
+		rospy.loginfo("Point Cloud Recorder wrote %d frames to %s.",self.frames,self.filename)
+
+if __name__ == '__main__':
+	node = rospy.init_node('cloud_recorder',anonymous=True)
+	r = Recorder(node)
+
+	rospy.spin()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+import roslib; roslib.load_manifest('pointcloud_compress')
+import rospy
+from std_msgs.msg import ByteMultiArray
+from std_msgs.msg import MultiArrayDimension
+import time
+import cloud_log
+from decompress import Decompressor
+
+# Republishes a log written by record.py through a Decompressor
+class Replayer:
+	def __init__(self, node):
+		self.node = node
+
+		# Get the parameters
+		self.filename = rospy.get_param("~file", 'clouds.pclog')
+		self.rate = rospy.get_param("~rate", 1.0)	# 1 is real time, 0 as fast as possible
+		self.start = rospy.get_param("~start", 0.0)	# seconds from the first frame
+		self.loop = rospy.get_param("~loop", False)
+
+		self.log = cloud_log.LogReader(self.filename)
+		self.decompressor = Decompressor(node, subscribe=False)
+
+		# Friendly info
+		rospy.loginfo("Point Cloud Replayer started.")
+		rospy.loginfo("Point Cloud Replayer reading:     %s (%d frames).",self.filename,len(self.log))
+		rospy.loginfo("Point Cloud Replayer rate:        %g.",self.rate)
+
+		self.compressed_msg = ByteMultiArray()
+		self.compressed_msg.layout.dim.append(MultiArrayDimension())
+
+	def play(self):
+		if not len(self.log):
+			return
+		first = self.log.seek(self.log.stamps()[0] + self.start)
+		start_stamp = self.log.stamps()[min(first, len(self.log) - 1)]
+		start_time = time.time()
+		for i in xrange(first, len(self.log)):
+			if rospy.is_shutdown():
+				return
+			stamp, data = self.log.frame(i)
+			if self.rate > 0:
+				delay = start_time + (stamp - start_stamp) / self.rate - time.time()
+				if delay > 0:
+					time.sleep(delay)
+			self.compressed_msg.data = data
+			self.compressed_msg.layout.dim[0].size = len(data)
+			self.decompressor.receive_cloud(self.compressed_msg)
+
+if __name__ == '__main__':
+	node = rospy.init_node('cloud_replayer',anonymous=True)
+	r = Replayer(node)
+	r.play()
+	while r.loop and not rospy.is_shutdown():
+		r.play()
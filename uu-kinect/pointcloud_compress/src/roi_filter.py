@@ -0,0 +1,104 @@
+"""
+Region of interest filter for PointCloud2, run before a cloud is encoded.
+
+Points outside an axis-aligned crop box or beyond a maximum range from the
+sensor are removed, and fields nobody downstream needs (rgb, padding bytes)
+are dropped.  The crop box is given in the cloud's own frame or, through
+tf, in any other frame (e.g. the robot base, so the floor can be cut off).
+
+Organized clouds keep their height and width, removed points become NaN so
+the depth and keyframe modes still see an image; unorganized clouds are
+compacted.  Everything works on a NumPy view of the data buffer.
+"""
+import numpy as np
+import rospy
+import cloud_fields
+
+class RoiFilter(object):
+	def __init__(self, crop_min=None, crop_max=None, crop_frame='', max_range=0.0,
+			drop_fields=(), drop_padding=False):
+		self.crop_min = self.crop_max = None
+		if crop_min:
+			self.crop_min = np.array(crop_min, np.float64)
+		if crop_max:
+			self.crop_max = np.array(crop_max, np.float64)
+		self.crop_frame = crop_frame
+		self.max_range = max_range
+		self.drop_fields = set(drop_fields)
+		self.drop_padding = drop_padding
+		self.listener = None
+		self.tf_failed = False
+		if crop_frame:
+			import tf
+			self.listener = tf.TransformListener()
+
+	def active(self):
+		return (self.crop_min is not None or self.crop_max is not None or self.max_range > 0
+				or self.drop_fields or self.drop_padding)
+
+	# Rotation and translation from the cloud's frame to the crop frame, None if unknown
+	def transform(self, cloud):
+		source = cloud.header.frame_id
+		if not self.crop_frame or self.crop_frame == source:
+			return np.eye(3), np.zeros(3)
+		import tf
+		try:
+			trans, rot = self.listener.lookupTransform(self.crop_frame, source, cloud.header.stamp)
+		except tf.Exception:
+			try:
+				trans, rot = self.listener.lookupTransform(self.crop_frame, source, rospy.Time(0))
+			except tf.Exception, e:
+				if not self.tf_failed:
+					rospy.logwarn("Point cloud ROI filter: no transform %s -> %s, not cropping: %s",
+							source, self.crop_frame, e)
+				self.tf_failed = True
+				return None
+		self.tf_failed = False
+		return tf.transformations.quaternion_matrix(rot)[:3, :3], np.array(trans)
+
+	# Points to keep, None for all of them
+	def mask(self, cloud, points):
+		if not cloud_fields.has_xyz(points.dtype):
+			return None
+		x, y, z = [points[axis] for axis in cloud_fields.XYZ]
+		keep = None
+		if self.max_range > 0:
+			keep = x * x + y * y + z * z <= self.max_range * self.max_range
+		transform = None
+		if self.crop_min is not None or self.crop_max is not None:
+			transform = self.transform(cloud)
+		if transform is not None:
+			rotation, translation = transform
+			if keep is None:
+				keep = np.ones(points.shape, bool)
+			for i in range(3):
+				axis = rotation[i, 0] * x + rotation[i, 1] * y + rotation[i, 2] * z + translation[i]
+				if self.crop_min is not None:
+					keep &= axis >= self.crop_min[i]
+				if self.crop_max is not None:
+					keep &= axis <= self.crop_max[i]
+		return keep
+
+	def filter(self, cloud):
+		if not self.active():
+			return cloud
+		points = cloud_fields.cloud_array(cloud)
+		olderr = np.seterr(invalid='ignore')	# NaN points fall outside
+		try:
+			keep = self.mask(cloud, points)
+		finally:
+			np.seterr(**olderr)
+
+		names = [n for n in points.dtype.names if n not in self.drop_fields]
+		if len(names) < len(points.dtype.names) or self.drop_padding:
+			points = cloud_fields.repack(points, names)
+		else:
+			points = points.copy()
+		if keep is None:
+			return cloud_fields.array_to_cloud(points, cloud.header, cloud.is_dense)
+		if cloud.height > 1:
+			for axis in cloud_fields.XYZ:
+				if axis in points.dtype.names:
+					points[axis][~keep] = np.nan
+			return cloud_fields.array_to_cloud(points, cloud.header, False)
+		return cloud_fields.array_to_cloud(points[keep], cloud.header, cloud.is_dense)
@@ -0,0 +1,161 @@
+"""
+Shared memory transport for point clouds between nodes on the same host.
+
+The producer copies each cloud once into a slot of a ring of fixed size
+slots in a file under /dev/shm and publishes only a small ShmFrame (slot,
+sequence, size).  Consumers map the same file read-only and copy the cloud
+out, so a multi-MB cloud is not serialized, sent over a socket and parsed
+again.  Remote consumers keep using the normal (compressed) topic; the
+decompressor with ~shm set republishes the shared clouds as PointCloud2.
+
+Every slot starts with a sequence counter used as a seqlock: the writer
+makes it odd while it writes and sets it to the frame's (even) sequence
+when done.  A reader that finds another sequence before or after copying
+the data was overtaken by the writer and drops the frame.
+
+Segment: MAGIC, number of slots, slot size (data bytes), then the slots,
+each SLOT followed by the cloud metadata (as in quantize.pack_meta) and data.
+"""
+import os
+import mmap
+import struct
+import threading
+import rospy
+from pointcloud_compress.msg import ShmFrame
+import quantize
+
+MAGIC = 'PCSHM01\0'
+SEGMENT = struct.Struct('<8sII')
+# sequence (odd while being written), bytes used
+SLOT = struct.Struct('<QI')
+DIRECTORY = '/dev/shm'
+
+def segment_path(name):
+	return os.path.join(DIRECTORY, name.lstrip('/'))
+
+class ShmWriter(object):
+	def __init__(self, name, slots=4, slot_size=12 << 20):
+		self.name = name
+		self.slots = slots
+		self.slot_size = slot_size
+		self.stride = SLOT.size + slot_size
+		size = SEGMENT.size + slots * self.stride
+		fd = os.open(segment_path(name), os.O_RDWR | os.O_CREAT, 0644)
+		try:
+			os.ftruncate(fd, size)
+			self.map = mmap.mmap(fd, size)
+		finally:
+			os.close(fd)
+		SEGMENT.pack_into(self.map, 0, MAGIC, slots, slot_size)
+		for slot in range(slots):
+			SLOT.pack_into(self.map, self.offset(slot), 0, 0)
+		self.sequence = 0
+		self.lock = threading.Lock()
+
+	def offset(self, slot):
+		return SEGMENT.size + slot * self.stride
+
+	# Copy a cloud into the next slot, returns its ShmFrame or None if it does not fit
+	def write(self, cloud):
+		meta = quantize.pack_meta(cloud)
+		size = len(meta) + len(cloud.data)
+		if size > self.slot_size:
+			return None
+		self.lock.acquire()
+		try:
+			self.sequence += 2
+			sequence = self.sequence
+			slot = (sequence // 2) % self.slots
+			start = self.offset(slot)
+			SLOT.pack_into(self.map, start, sequence - 1, 0)
+			start += SLOT.size
+			self.map[start:start + len(meta)] = meta
+			self.map[start + len(meta):start + size] = cloud.data
+			SLOT.pack_into(self.map, self.offset(slot), sequence, size)
+		finally:
+			self.lock.release()
+		return ShmFrame(header=cloud.header, segment=self.name, slot=slot, sequence=sequence, size=size)
+
+	# Remove the segment, readers that have it mapped keep their mapping
+	def close(self):
+		self.map.close()
+		try:
+			os.unlink(segment_path(self.name))
+		except OSError:
+			pass
+
+class ShmReader(object):
+	def __init__(self, name):
+		self.name = name
+		self.map = None
+		self.inode = None
+
+	# Map the segment, again if the producer has recreated it
+	def open(self):
+		path = segment_path(self.name)
+		inode = os.stat(path).st_ino
+		if self.map is not None and inode == self.inode:
+			return
+		f = open(path, 'rb')
+		try:
+			self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			f.close()
+		self.inode = inode
+		magic, self.slots, self.slot_size = SEGMENT.unpack_from(self.map)
+		if magic != MAGIC:
+			self.map = None
+			raise ValueError("%s is not a point cloud segment" % path)
+
+	# The cloud a ShmFrame describes, None when it has been overwritten already
+	def read(self, frame):
+		if self.map is None or frame.slot >= self.slots:
+			self.open()
+		start = SEGMENT.size + frame.slot * (SLOT.size + self.slot_size)
+		sequence, size = SLOT.unpack_from(self.map, start)
+		if sequence != frame.sequence:
+			self.open()	# maybe a new segment
+			sequence, size = SLOT.unpack_from(self.map, start)
+			if sequence != frame.sequence:
+				return None
+		try:
+			cloud, offset = quantize.unpack_meta(self.map, start + SLOT.size)
+			cloud.data = self.map[offset:start + SLOT.size + size]
+		except Exception:
+			if SLOT.unpack_from(self.map, start)[0] == frame.sequence:
+				raise
+			return None	# garbled by the writer
+		if SLOT.unpack_from(self.map, start)[0] != frame.sequence:
+			return None
+		return cloud
+
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+
+# Calls callback with every cloud announced on a ShmFrame topic.  Frames that
+# were overwritten before they could be read are counted in dropped (and
+# reported to on_drop).
+class ShmSubscriber(object):
+	def __init__(self, topic, callback, on_drop=None):
+		self.callback = callback
+		self.on_drop = on_drop
+		self.readers = {}
+		self.dropped = 0
+		self.subscriber = rospy.Subscriber(topic, ShmFrame, self.receive)
+
+	def receive(self, frame):
+		if frame.segment not in self.readers:
+			self.readers[frame.segment] = ShmReader(frame.segment)
+		try:
+			cloud = self.readers[frame.segment].read(frame)
+		except (OSError, IOError, ValueError), e:
+			rospy.logwarn("Shared memory point cloud %s: %s", frame.segment, e)
+			cloud = None
+		if cloud is None:
+			self.dropped += 1
+			if self.on_drop is not None:
+				self.on_drop()
+			return
+		self.callback(cloud)
@@ -0,0 +1,87 @@
+"""
+Synthetic organized point clouds resembling Kinect frames, for benchmarks
+and round trip checks without a camera or a ROS master.
+
+A pinhole camera looks into a box shaped room (floor, ceiling, side walls
+and a back wall) in which a person, an upright cylinder, walks across from
+frame to frame.  Depth gets Kinect-like noise growing with the square of the
+distance and millimetre steps; pixels out of range and in random blobs are
+NaN.  Colour is a smooth texture per surface with a little noise, packed as
+the float32 rgb field the openni driver publishes.
+"""
+import numpy as np
+import rospy
+from std_msgs.msg import Header
+import cloud_fields
+
+# x, y, z, padding, rgb, padding: the openni driver's layout
+KINECT_DTYPE = np.dtype({'names': ['x', 'y', 'z', 'rgb'], 'formats': ['<f4'] * 4,
+		'offsets': [0, 4, 8, 16], 'itemsize': 32})
+# room bounds in the camera frame (y points down), metres
+LEFT, RIGHT, CEILING, FLOOR, BACK = -2.5, 2.5, -1.2, 1.3, 4.5
+MAX_RANGE = 5.0
+COLOURS = np.array([[200, 190, 170], [180, 180, 185], [150, 120, 90],
+		[170, 180, 160], [220, 215, 200], [60, 80, 140]], np.float32)
+
+def camera_rays(height, width):
+	f = 525.0 * width / 640.0
+	v, u = np.mgrid[0:height, 0:width].astype(np.float32)
+	return (u - (width - 1) / 2.0) / f, (v - (height - 1) / 2.0) / f
+
+# Depth along the optical axis of the room surfaces, and which surface was hit
+def room(dx, dy):
+	olderr = np.seterr(divide='ignore', invalid='ignore')
+	candidates = np.array([
+		np.where(dx < 0, LEFT / dx, np.inf),
+		np.where(dx > 0, RIGHT / dx, np.inf),
+		np.where(dy < 0, CEILING / dy, np.inf),
+		np.where(dy > 0, FLOOR / dy, np.inf),
+		np.ones_like(dx) * BACK])
+	np.seterr(**olderr)
+	surface = candidates.argmin(axis=0)
+	return candidates.min(axis=0), surface
+
+# Where the rays hit an upright cylinder standing on the floor at (px, pz)
+def person(dx, dy, px, pz, radius=0.25, top=-0.5):
+	a = dx * dx + 1
+	b = -2 * (dx * px + pz)
+	c = px * px + pz * pz - radius * radius
+	disc = b * b - 4 * a * c
+	hit = disc >= 0
+	z = np.where(hit, (-b - np.sqrt(np.maximum(disc, 0))) / (2 * a), np.inf)
+	olderr = np.seterr(invalid='ignore')	# inf * 0 on the centre row
+	y = z * dy
+	inside = hit & (y > top) & (y < FLOOR)
+	np.seterr(**olderr)
+	return np.where(inside, z, np.inf)
+
+def frame(height=480, width=640, index=0, seed=0, colour=True):
+	random = np.random.RandomState(seed * 100003 + index)
+	dx, dy = camera_rays(height, width)
+	z, surface = room(dx, dy)
+	walker = person(dx, dy, -1.5 + 0.05 * (index % 60), 2.5)
+	surface[walker < z] = len(COLOURS) - 1
+	z = np.minimum(z, walker)
+
+	z = z + random.normal(0, 1, z.shape) * 1.5e-3 * z * z
+	z = np.round(z / 0.001) * 0.001
+	blobs = random.rand((height + 15) // 16, (width + 15) // 16) < 0.03
+	blobs = blobs.repeat(16, 0).repeat(16, 1)[:height, :width]
+	z[(z > MAX_RANGE) | blobs | (random.rand(height, width) < 0.01)] = np.nan
+
+	points = np.zeros((height, width), KINECT_DTYPE)
+	points['x'] = dx * z
+	points['y'] = dy * z
+	points['z'] = z
+	if colour:
+		shade = COLOURS[surface] * (0.8 + 0.2 * np.cos(dx * 3)[..., None] * np.cos(dy * 2)[..., None])
+		shade += random.normal(0, 4, shade.shape)
+		rgb = np.clip(shade, 0, 255).astype(np.uint32)
+		points['rgb'] = ((rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]).view(np.float32)
+	else:
+		points = cloud_fields.repack(points, cloud_fields.XYZ)
+	header = Header(seq=index, stamp=rospy.Time.from_sec(1000 + index / 30.0), frame_id='/openni_rgb_optical_frame')
+	return cloud_fields.array_to_cloud(points, header)
+
+def frames(count, height=480, width=640, seed=0, colour=True):
+	return [frame(height, width, i, seed, colour) for i in range(count)]
@@ -0,0 +1,136 @@
+"""
+Rolling statistics for the compressor and decompressor nodes.
+
+Every processed frame is recorded into fixed size ring buffers, and a
+CompressionStats message summarising the last window frames is published
+periodically.
+"""
+import threading
+import time
+import numpy as np
+import rospy
+from pointcloud_compress.msg import CompressionStats
+
+# The last size values in a fixed array; not locked, Telemetry only uses it
+# under its lock
+class RingBuffer(object):
+	def __init__(self, size):
+		self.values = np.zeros(size)
+		self.count = 0
+
+	def add(self, value):
+		self.values[self.count % len(self.values)] = value
+		self.count += 1
+
+	def data(self):
+		return self.values[:min(self.count, len(self.values))]
+
+	def __len__(self):
+		return min(self.count, len(self.values))
+
+	def mean(self):
+		return len(self) and self.data().mean() or 0.0
+
+	def percentile(self, q):
+		return len(self) and np.percentile(self.data(), q) or 0.0
+
+	# Values per second between the oldest and newest (times)
+	def rate(self):
+		first, last = self.span()
+		if last <= first:
+			return 0.0
+		return (len(self) - 1) / (last - first)
+
+	# Oldest and newest value
+	def span(self):
+		if not len(self):
+			return 0.0, 0.0
+		newest = (self.count - 1) % len(self.values)
+		oldest = self.count > len(self.values) and (newest + 1) % len(self.values) or 0
+		return self.values[oldest], self.values[newest]
+
+class Telemetry(object):
+	def __init__(self, topic, window=100, period=1.0):
+		self.lock = threading.Lock()
+		self.raw_bytes = RingBuffer(window)
+		self.compressed_bytes = RingBuffer(window)
+		self.latency = RingBuffer(window)
+		self.delay = RingBuffer(window)
+		self.times = RingBuffer(window)
+		self.publish_latency = RingBuffer(window)
+		self.frames = 0
+		self.dropped = 0
+		self.compressed_total = 0
+		self.publish_total = 0.0	# seconds
+		self.publisher = rospy.Publisher(topic, CompressionStats)
+		if period > 0:
+			rospy.Timer(rospy.Duration(period), self.publish)
+
+	# One frame done: its sizes, processing time and header stamp
+	def record(self, raw_bytes, compressed_bytes, latency, stamp=None):
+		now = time.time()
+		self.lock.acquire()
+		self.raw_bytes.add(raw_bytes)
+		self.compressed_bytes.add(compressed_bytes)
+		self.latency.add(latency)
+		if stamp is not None and stamp.secs:
+			self.delay.add(now - stamp.to_sec())
+		self.times.add(now)
+		self.frames += 1
+		self.compressed_total += compressed_bytes
+		self.lock.release()
+
+	# Time spent handing a frame to the publisher
+	def record_publish(self, latency):
+		self.lock.acquire()
+		self.publish_latency.add(latency)
+		self.publish_total += latency
+		self.lock.release()
+
+	# Compressed bytes and seconds spent publishing since start
+	def totals(self):
+		self.lock.acquire()
+		try:
+			return self.compressed_total, self.publish_total
+		finally:
+			self.lock.release()
+
+	# Frames recorded per second over the window
+	def rate(self):
+		self.lock.acquire()
+		try:
+			return self.times.rate()
+		finally:
+			self.lock.release()
+
+	def drop(self, frames=1):
+		self.lock.acquire()
+		self.dropped += frames
+		self.lock.release()
+
+	def stats(self):
+		msg = CompressionStats()
+		msg.header.stamp = rospy.Time.now()
+		self.lock.acquire()
+		try:
+			msg.window = len(self.times)
+			msg.frames = self.frames
+			msg.dropped = self.dropped
+			msg.hz = self.times.rate()
+			msg.raw_bytes = self.raw_bytes.mean()
+			msg.compressed_bytes = self.compressed_bytes.mean()
+			if msg.compressed_bytes:
+				msg.ratio = msg.raw_bytes / msg.compressed_bytes
+			msg.kbps = msg.compressed_bytes * 8 * msg.hz / 1000.0
+			msg.latency_p50 = self.latency.percentile(50)
+			msg.latency_p90 = self.latency.percentile(90)
+			msg.latency_p99 = self.latency.percentile(99)
+			msg.latency_max = len(self.latency) and self.latency.data().max() or 0.0
+			msg.delay_p50 = self.delay.percentile(50)
+			msg.delay_p99 = self.delay.percentile(99)
+		finally:
+			self.lock.release()
+		return msg
+
+	def publish(self, event=None):
+		self.publisher.publish(self.stats())
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# Round trip check of the point cloud modes and codecs, no ROS master needed.
+#
+# Clouds (synthetic Kinect-like frames, or the frames of a log written by
+# record.py) are compressed and decompressed with every mode/codec pair and
+# compared with the original: point count, NaN handling, and per-field max
+# and RMS error (per channel for colour), along with throughput.  Points are
+# matched by pixel for organized output and otherwise to the nearest decoded
+# point (needs scipy; without it, in order when the counts agree and the mode
+# keeps the point order, else not at all).  One JSON object per case is
+# printed; the exit status is 1 when a case exceeds the accuracy budget.
+#
+#   verify.py --modes quantized,depth --max-error 0.001 --max-colour-error 8
+#   verify.py --log clouds.pclog --modes raw,lossless --exact
+import roslib; roslib.load_manifest('pointcloud_compress')
+import sys
+import json
+import time
+import argparse
+import numpy as np
+try:
+	from scipy.spatial import cKDTree
+except ImportError:
+	cKDTree = None
+import codec
+import buffers
+import cloud_fields
+import colour
+import synthetic
+import benchmark
+
+CHANNELS = (('r', 16), ('g', 8), ('b', 0))
+# Modes whose unorganized output keeps the order of the input points (octree
+# sends them in Morton order)
+ORDERED_MODES = ('raw', 'lossless', 'quantized', 'keyframe', 'depth')
+
+# Values of each comparable field as float arrays, colour split into channels
+def field_values(points, names):
+	values = {}
+	for name in names:
+		if name in colour.COLOUR_FIELDS:
+			packed = np.ascontiguousarray(points[name]).view(np.uint32)
+			for channel, shift in CHANNELS:
+				values['%s.%s' % (name, channel)] = ((packed >> shift) & 0xff).astype(np.float64)
+		elif points.dtype.fields[name][0].subdtype is None:
+			values[name] = points[name].astype(np.float64)
+	return values
+
+# Pairs of (original, decoded) points, and how they were matched
+def match(original, decoded, organized, ordered):
+	valid = cloud_fields.valid_mask(original)
+	if organized:
+		return original.ravel(), decoded.ravel(), 'pixel'
+	decoded_valid = decoded[cloud_fields.valid_mask(decoded)]
+	if cKDTree is None:
+		if ordered and len(decoded_valid) == valid.sum():
+			return original[valid], decoded_valid, 'order'
+		return None, None, 'none'
+	if not len(decoded_valid) or not valid.any():
+		return None, None, 'none'
+	xyz = lambda p: np.column_stack([p[axis] for axis in cloud_fields.XYZ])
+	nearest = cKDTree(xyz(decoded_valid)).query(xyz(original[valid]))[1]
+	return original[valid], decoded_valid[nearest], 'nearest'
+
+# Errors of one decoded cloud against its original
+def compare(cloud, decoded, ordered=True):
+	original = cloud_fields.cloud_array(cloud).ravel()
+	result = {'points_in': int(cloud_fields.valid_mask(original).sum()), 'points_out': 0, 'fields': {}}
+	if decoded is None:
+		result['match'] = 'lost'
+		return result
+	out = cloud_fields.cloud_array(decoded).ravel()
+	if cloud_fields.has_xyz(out.dtype):
+		result['points_out'] = int(cloud_fields.valid_mask(out).sum())
+	else:
+		result['points_out'] = len(out)
+	organized = decoded.height == cloud.height and decoded.width == cloud.width and cloud.height > 1
+	if not cloud_fields.has_xyz(original.dtype) or not cloud_fields.has_xyz(out.dtype):
+		result['match'] = 'none'
+		return result
+	a, b, result['match'] = match(original, out, organized, ordered)
+	if organized:
+		valid_a, valid_b = cloud_fields.valid_mask(a), cloud_fields.valid_mask(b)
+		result['nan_lost'] = int((valid_a & ~valid_b).sum())	# valid points that came back NaN
+		result['nan_gained'] = int((~valid_a & valid_b).sum())	# NaN points that came back valid
+		a, b = a[valid_a & valid_b], b[valid_a & valid_b]
+	if a is None:
+		return result
+	names = [n for n in original.dtype.names if n in out.dtype.names]
+	before, after = field_values(a, names), field_values(b, names)
+	for name in sorted(before):
+		error = np.abs(after[name] - before[name])
+		result['fields'][name] = {
+			'max': float(error.max()) if len(error) else 0.0,
+			'sum_sq': float((error * error).sum()), 'count': len(error)}
+	return result
+
+# Fold the per frame comparisons of a case into one result
+def summarize(comparisons):
+	summary = {'points_in': 0, 'points_out': 0, 'nan_lost': 0, 'nan_gained': 0, 'lost_frames': 0,
+			'match': sorted(set([c['match'] for c in comparisons])), 'fields': {}}
+	for c in comparisons:
+		summary['points_in'] += c['points_in']
+		summary['points_out'] += c['points_out']
+		summary['nan_lost'] += c.get('nan_lost', 0)
+		summary['nan_gained'] += c.get('nan_gained', 0)
+		summary['lost_frames'] += c['match'] == 'lost'
+		for name, error in c['fields'].items():
+			total = summary['fields'].setdefault(name, {'max': 0.0, 'sum_sq': 0.0, 'count': 0})
+			total['max'] = max(total['max'], error['max'])
+			total['sum_sq'] += error['sum_sq']
+			total['count'] += error['count']
+	for name, total in summary['fields'].items():
+		summary['fields'][name] = {'max': total['max'],
+				'rms': (total['sum_sq'] / max(total['count'], 1)) ** 0.5}
+	summary['point_delta'] = summary['points_out'] - summary['points_in']
+	return summary
+
+def run_case(clouds, mode, codec_name, level, params):
+	encoder = codec.make_mode(mode, params)
+	decoder = codec.make_mode(mode, params)
+	packed, unpacked = buffers.Buffer(), buffers.Buffer()
+	compress = decompress = 0.0
+	raw_bytes = compressed_bytes = 0
+	comparisons = []
+	for cloud in clouds:
+		start = time.time()
+		data = str(codec.pack_into(packed, mode, codec_name, level, cloud.header.stamp, encoder.encode(cloud)))
+		compress += time.time() - start
+		start = time.time()
+		header, payload = codec.unpack_into(unpacked, data)
+		decoded = decoder.decode(payload)
+		decompress += time.time() - start
+		raw_bytes += len(cloud.data)
+		compressed_bytes += len(data)
+		comparisons.append(compare(cloud, decoded, mode in ORDERED_MODES))
+	result = summarize(comparisons)
+	result.update({
+		'mode': mode, 'codec': codec_name, 'level': level, 'frames': len(clouds),
+		'ratio': float(raw_bytes) / max(compressed_bytes, 1),
+		'compress_mb_s': raw_bytes / 1e6 / max(compress, 1e-9),
+		'decompress_mb_s': raw_bytes / 1e6 / max(decompress, 1e-9),
+	})
+	return result
+
+# Reasons the result is outside the budget, none if it is within
+def violations(result, args):
+	found = []
+	if result['lost_frames']:
+		found.append("%d frames not decoded" % result['lost_frames'])
+	for name, error in sorted(result['fields'].items()):
+		limit = None
+		if args.exact:
+			limit = 0.0
+		elif name in cloud_fields.XYZ:
+			limit = args.max_error
+		elif '.' in name:
+			limit = args.max_colour_error
+		if limit is not None and error['max'] > limit:
+			found.append("%s max error %g > %g" % (name, error['max'], limit))
+	if args.max_point_loss is not None and result['points_in']:
+		loss = -float(result['point_delta']) / result['points_in']
+		if loss > args.max_point_loss:
+			found.append("lost %.1f%% of the points" % (100 * loss))
+	if args.exact and (result['point_delta'] or result['nan_lost'] or result['nan_gained']):
+		found.append("point count or NaN pattern changed")
+	return found
+
+def main(argv):
+	parser = argparse.ArgumentParser(description="Check point cloud compression round trips.")
+	parser.add_argument('--sizes', default='160x120,640x480', help="synthetic frame sizes, WxH")
+	parser.add_argument('--frames', type=int, default=5, help="frames per case")
+	parser.add_argument('--modes', default=','.join(sorted(codec.MODES)))
+	parser.add_argument('--codecs', default='zlib')
+	parser.add_argument('--level', type=int, default=6)
+	parser.add_argument('--resolution', type=float, default=0.001)
+	parser.add_argument('--colour-bits', type=int, default=8)
+	parser.add_argument('--colour-format', default='rgb', choices=sorted(colour.FORMATS))
+	parser.add_argument('--log', help="check the frames of a recorded log instead")
+	parser.add_argument('--max-error', type=float, help="budget for x/y/z, metres")
+	parser.add_argument('--max-colour-error', type=float, help="budget per colour channel, 0-255")
+	parser.add_argument('--max-point-loss', type=float, help="budget for lost valid points, fraction")
+	parser.add_argument('--exact', action='store_true', help="require a bit-exact round trip")
+	parser.add_argument('--output', help="also append the results to this file")
+	args = parser.parse_args(argv)
+
+	if args.log:
+		sets = [(args.log, benchmark.log_frames(args.log, args.frames))]
+	else:
+		sets = []
+		for size in args.sizes.split(','):
+			width, height = [int(n) for n in size.split('x')]
+			sets.append((size, synthetic.frames(args.frames, height, width)))
+	params = {'resolution': args.resolution, 'colour_bits': args.colour_bits,
+			'colour_format': args.colour_format}
+
+	failed = False
+	output = args.output and open(args.output, 'a')
+	for source, clouds in sets:
+		for mode in args.modes.split(','):
+			for codec_name in args.codecs.split(','):
+				result = run_case(clouds, mode, codec_name, args.level, params)
+				result['source'] = source
+				result['violations'] = violations(result, args)
+				failed = failed or bool(result['violations'])
+				line = json.dumps(result, sort_keys=True)
+				print line
+				sys.stdout.flush()
+				if output:
+					output.write(line + '\n')
+	if output:
+		output.close()
+	return failed and 1 or 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
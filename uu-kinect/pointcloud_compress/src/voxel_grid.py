@@ -0,0 +1,110 @@
+"""
+Voxel grid downsampling of a PointCloud2 with NumPy.
+
+Valid points are binned into cubic voxels of voxel_size metres and every
+occupied voxel is replaced by the average of its points.  Scalar fields are
+averaged as numbers, packed rgb/rgba fields per colour channel.  Fields with
+a count above one are dropped.  The result is an unorganized, packed cloud.
+
+Sorting the voxel keys would cost more than all the rest, so the voxels are
+numbered through a hash table instead (see voxel_index), and every field is
+then averaged with bincounts over the voxel numbers.
+"""
+import numpy as np
+import cloud_fields
+
+COLOUR_FIELDS = ('rgb', 'rgba')
+# Fibonacci hashing multipliers per key width, one per round of voxel_index
+MULTIPLIERS = {
+	4: (0x9E3779B9, 0x85EBCA6B, 0xC2B2AE35),
+	8: (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9),
+}
+
+# Number the occupied voxels, returns the number of voxels and each point's
+# voxel.  Every point writes its index into a hash table slot by its key, the
+# point left in the slot represents all points with the same key.  Points
+# whose representative has another key take the next round with another
+# hash, the few left after the last round are sorted.  The voxels are then
+# numbered in the order of their representatives.
+def voxel_index(key):
+	unsigned = key.dtype.str.replace('i', 'u')
+	width = 8 * key.itemsize
+	every = np.arange(len(key))
+	inverse = None
+	todo = every
+	for multiplier in MULTIPLIERS[key.itemsize]:
+		keys = key if inverse is None else key[todo]
+		bits = max(len(keys) - 1, 1).bit_length()
+		slot = keys.view(unsigned) * np.dtype(unsigned).type(multiplier)
+		slot >>= width - bits
+		slot = slot.astype(np.intp)
+		table = np.empty(1 << bits, np.intp)
+		table[slot] = todo
+		representative = table[slot]
+		lost = np.flatnonzero(key[representative] != keys)
+		if inverse is None:
+			inverse = representative
+			todo = lost
+		else:
+			inverse[todo] = representative
+			todo = todo[lost]
+		if not len(todo):
+			break
+	else:
+		voxels, first, rest = np.unique(key[todo], return_index=True, return_inverse=True)
+		inverse[todo] = todo[first][rest]
+	representatives = np.flatnonzero(inverse == every)
+	number = np.empty(len(key), np.intp)
+	number[representatives] = np.arange(len(representatives))
+	return len(representatives), number[inverse]
+
+# Average packed 8 bit colour channels per voxel, an alpha byte that is the
+# same for all points (usually the unused one of rgb) is copied.
+def average_colour(packed, inverse, reciprocal):
+	channels = np.ascontiguousarray(packed).view(np.uint8).reshape(-1, 4)
+	out = np.empty((len(reciprocal), 4), np.uint8)
+	for i in range(4):
+		channel = channels[:, i]
+		if i == 3 and channel.min() == channel.max():
+			out[:, i] = channel[0]
+		else:
+			sums = np.bincount(inverse, channel, len(reciprocal))
+			sums *= reciprocal
+			sums += 0.5
+			out[:, i] = sums
+	return out.view(np.uint32).ravel()
+
+def voxel_filter(cloud, voxel_size):
+	points = cloud_fields.cloud_array(cloud).ravel()
+	valid = np.flatnonzero(cloud_fields.valid_mask(points))
+	names = [n for n in points.dtype.names if points.dtype.fields[n][0].shape == ()]
+	out_dtype = cloud_fields.packed_dtype(points.dtype, names)
+	if not len(valid):
+		return cloud_fields.array_to_cloud(np.empty(0, out_dtype), cloud.header, True)
+
+	# One integer key per voxel, 32 bit when the grid allows
+	values = dict((name, points[name][valid]) for name in names)
+	indices = []
+	for axis in cloud_fields.XYZ:
+		scaled = values[axis] / values[axis].dtype.type(voxel_size)
+		np.floor(scaled, scaled)
+		scaled -= scaled.min()
+		index = scaled.astype(np.int32 if scaled.max() < 2 ** 31 else np.int64)
+		indices.append((index, int(index.max()) + 1))
+	cells = indices[0][1] * indices[1][1] * indices[2][1]
+	key = np.zeros(len(valid), np.int32 if cells < 2 ** 31 else np.int64)
+	for index, extent in indices:
+		key *= extent
+		key += index
+	n, inverse = voxel_index(key)
+	reciprocal = 1.0 / np.bincount(inverse, minlength=n)
+
+	out = np.empty(n, out_dtype)
+	for name in out_dtype.names:
+		if name in COLOUR_FIELDS:
+			out[name] = average_colour(values[name], inverse, reciprocal).view(out_dtype.fields[name][0])
+		else:
+			sums = np.bincount(inverse, values[name], n)
+			sums *= reciprocal
+			out[name] = sums
+	return cloud_fields.array_to_cloud(out, cloud.header, True)